@@ -89,6 +89,43 @@ class HTTP(BaseSetting):
     serve_static_files: bool = Field(
         bool(os.getenv("BGMI_HTTP_SERVE_STATIC_FILES")), description="use tornado serving video files"
     )
+    executor_workers: int = Field(
+        int(os.getenv("BGMI_HTTP_EXECUTOR_WORKERS") or "4"),
+        ge=1,
+        description="threads running database queries and actions of web api",
+    )
+    action_timeout: float = Field(
+        float(os.getenv("BGMI_HTTP_ACTION_TIMEOUT") or "120"),
+        ge=0,
+        description="seconds to wait for a web api action before responding 504, 0 for no limit",
+    )
+
+
+class DatabaseConfig(BaseSetting):
+    journal_mode: typing.Literal["wal", "delete", "truncate", "persist", "memory"] = Field(
+        os.getenv("BGMI_DB_JOURNAL_MODE") or "wal",  # type: ignore
+        description="wal let web server read database while `bgmi update` is writing",
+    )
+    synchronous: typing.Literal["off", "normal", "full", "extra"] = Field(
+        os.getenv("BGMI_DB_SYNCHRONOUS") or "normal",  # type: ignore
+        description="normal is safe with wal, only last transactions may be lost on power failure",
+    )
+    cache_size: int = Field(
+        int(os.getenv("BGMI_DB_CACHE_SIZE") or "-8000"),
+        description="pages if positive, KiB if negative",
+    )
+    mmap_size: int = Field(int(os.getenv("BGMI_DB_MMAP_SIZE") or str(64 * 1024 * 1024)), ge=0, description="bytes")
+    busy_timeout: int = Field(
+        int(os.getenv("BGMI_DB_BUSY_TIMEOUT") or "5000"),
+        ge=0,
+        description="milliseconds to wait for other connections to release lock",
+    )
+    temp_store: typing.Literal["default", "file", "memory"] = Field(
+        os.getenv("BGMI_DB_TEMP_STORE") or "memory"  # type: ignore
+    )
+
+    def pragmas(self) -> dict[str, typing.Any]:
+        return self.model_dump()
 
 
 class Config(BaseSetting):
@@ -117,6 +154,31 @@ class Config(BaseSetting):
 
     max_path: int = 3
 
+    update_workers: int = Field(
+        int(os.getenv("BGMI_UPDATE_WORKERS") or "4"),
+        ge=1,
+        description="how many subscriptions will be fetched concurrently when updating",
+    )
+    max_connections_per_host: int = Field(
+        int(os.getenv("BGMI_MAX_CONNECTIONS_PER_HOST") or "4"),
+        ge=1,
+        description="max concurrent http connections to a single host",
+    )
+    request_timeout: float = Field(
+        float(os.getenv("BGMI_REQUEST_TIMEOUT") or "60"),
+        gt=0,
+        description="default timeout in seconds of http requests",
+    )
+    max_active_downloads: int = Field(
+        int(os.getenv("BGMI_MAX_ACTIVE_DOWNLOADS") or "0"),
+        ge=0,
+        description="max tasks downloading in download delegate at the same time, 0 for unlimited",
+    )
+    enable_http_cache: bool = Field(
+        os.getenv("BGMI_ENABLE_HTTP_CACHE", "1") != "0",
+        description="cache website responses in tmp_path and revalidate them with ETag / Last-Modified",
+    )
+
     bangumi_moe_url: HttpUrl = Field(
         os.getenv("BGMI_BANGUMI_MOE_URL") or "https://bangumi.moe", description="Setting bangumi.moe url"
     )  # type: ignore
@@ -132,6 +194,8 @@ class Config(BaseSetting):
 
     http: HTTP = HTTP()
 
+    database: DatabaseConfig = DatabaseConfig()
+
     # language
     lang: str = os.getenv("BGMI_LANG") or "zh_cn"
 
@@ -1,8 +1,8 @@
 import xmlrpc.client
-from typing import cast
+from typing import Any, Dict, List, Tuple, cast
 
 from bgmi.config import cfg
-from bgmi.plugin.download import BaseDownloadService, DownloadStatus
+from bgmi.plugin.download import AddDownloadResult, BaseDownloadService, DownloadStatus, TaskStatus
 from bgmi.utils import print_error, print_warning
 
 
@@ -14,8 +14,7 @@ class Aria2DownloadRPC(BaseDownloadService):
         else:
             self.token = "token:" + cfg.aria2.rpc_token
 
-        s = xmlrpc.client.ServerProxy(cfg.aria2.rpc_url)
-        r = s.aria2.getVersion(cfg.aria2.rpc_token)
+        r = self.server.aria2.getVersion(self.token)
         version = r["version"]
         if version:
             old_version = [int(x) for x in version.split(".")] < [1, 18, 4]
@@ -28,6 +27,29 @@ class Aria2DownloadRPC(BaseDownloadService):
         args = [[url], {"dir": save_path}]
         return cast(str, self.server.aria2.addUri(self.token, *args))
 
+    def add_downloads(self, batch: List[Tuple[str, str]]) -> List[AddDownloadResult]:
+        if not batch:
+            return []
+
+        calls = [
+            {"methodName": "aria2.addUri", "params": [self.token, [url], {"dir": save_path}]}
+            for url, save_path in batch
+        ]
+        try:
+            responses = self.server.system.multicall(calls)
+        except (OSError, xmlrpc.client.Error) as e:
+            return [AddDownloadResult(error=e)] * len(batch)
+
+        # successful call returns a list of single value, failed one returns a fault struct
+        return [
+            (
+                AddDownloadResult(task_id=r[0])
+                if isinstance(r, list)
+                else AddDownloadResult(error=xmlrpc.client.Fault(r["faultCode"], r["faultString"]))
+            )
+            for r in cast(List[Any], responses)
+        ]
+
     @staticmethod
     def check_config() -> None:
         if not cfg.aria2.rpc_url.endswith("/rpc"):
@@ -35,14 +57,47 @@ class Aria2DownloadRPC(BaseDownloadService):
         if not cfg.aria2.rpc_token.startswith("token:"):
             print_warning("rpc token should starts with `token:`")
 
-    def get_status(self, id: str) -> DownloadStatus:
-        args = (id, ["status"])
-        r = self.server.aria2.tellStatus(self.token, *args)
+    def health_check(self) -> bool:
+        try:
+            self.server.aria2.getVersion(self.token)
+        except (OSError, xmlrpc.client.Error):
+            return False
+        return True
 
+    @staticmethod
+    def _status(status: str) -> DownloadStatus:
         return {
             "active": DownloadStatus.downloading,
             "waiting": DownloadStatus.downloading,
             "paused": DownloadStatus.not_downloading,
             "error": DownloadStatus.error,
             "complete": DownloadStatus.done,
-        }.get(r["status"], DownloadStatus.error)
+        }.get(status, DownloadStatus.error)
+
+    def get_status(self, id: str) -> DownloadStatus:
+        return self.get_task_statuses([id])[id].status
+
+    def get_statuses(self, ids: List[str]) -> Dict[str, DownloadStatus]:
+        return {id: x.status for id, x in self.get_task_statuses(ids).items()}
+
+    def get_task_statuses(self, ids: List[str]) -> Dict[str, TaskStatus]:
+        if not ids:
+            return {}
+
+        calls = [{"methodName": "aria2.tellStatus", "params": [self.token, id, ["status", "followedBy"]]} for id in ids]
+        responses = self.server.system.multicall(calls)
+
+        result = {}
+        for id, r in zip(ids, cast(List[Any], responses)):
+            # aria2 returns a fault if gid is not found, or its result is removed from memory
+            if not isinstance(r, list):
+                result[id] = TaskStatus(DownloadStatus.not_found)
+                continue
+            # task of magnet link or torrent url only downloads metadata or torrent file,
+            # content is downloaded by the task in ``followedBy``
+            followed_by = r[0].get("followedBy")
+            if followed_by:
+                result[id] = TaskStatus(DownloadStatus.downloading, followed_by=followed_by[0])
+            else:
+                result[id] = TaskStatus(self._status(r[0]["status"]))
+        return result
@@ -1,3 +1,5 @@
+from typing import Dict, List
+
 import requests
 
 from bgmi.config import cfg
@@ -14,15 +16,33 @@ class DelugeRPC(BaseDownloadService):
     def check_config() -> None:
         pass
 
-    def get_status(self, id: str) -> DownloadStatus:
-        status = self._call("web.get_torrent_status", [id, ["state"]])
+    def health_check(self) -> bool:
+        try:
+            return bool(self._call("auth.check_session"))
+        except (requests.RequestException, ValueError, RpcError):
+            return False
 
+    @staticmethod
+    def _status(state: str) -> DownloadStatus:
         return {
             "Error": DownloadStatus.error,
             "Downloading": DownloadStatus.downloading,
             "Paused": DownloadStatus.not_downloading,
             "Seeding": DownloadStatus.done,
-        }.get(status["state"], DownloadStatus.error)
+        }.get(state, DownloadStatus.error)
+
+    def get_status(self, id: str) -> DownloadStatus:
+        status = self._call("web.get_torrent_status", [id, ["state"]])
+
+        return self._status(status["state"])
+
+    def get_statuses(self, ids: List[str]) -> Dict[str, DownloadStatus]:
+        if not ids:
+            return {}
+
+        # keyed by torrent id, missing torrents are not in result
+        status = self._call("core.get_torrents_status", [{"id": ids}, ["state"]])
+        return {id: self._status(status[id]["state"]) if id in status else DownloadStatus.not_found for id in ids}
 
     def add_download(self, url: str, save_path: str):
         options = {
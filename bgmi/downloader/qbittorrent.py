@@ -1,8 +1,13 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
 import qbittorrentapi
 from qbittorrentapi import TorrentState
 
 from bgmi.config import cfg
-from bgmi.plugin.download import BaseDownloadService, DownloadStatus
+from bgmi.plugin.download import AddDownloadResult, BaseDownloadService, DownloadStatus, RpcError
+from bgmi.utils import print_info, print_warning
+from bgmi.website.model import extract_infohash
 
 
 class QBittorrentWebAPI(BaseDownloadService):
@@ -29,20 +34,88 @@ class QBittorrentWebAPI(BaseDownloadService):
             tags=cfg.qbittorrent.tags,
         )
 
-        info = self.client.torrents_info(sort="added_on")
+        return self._task_ids([url])[0]
+
+    def _task_ids(self, urls: List[str]) -> List[Optional[str]]:
+        """
+        task id is infohash of torrent, it's read from url instead of guessing from torrent list.
+        ``None`` if url doesn't contain infohash.
+        """
+        hashes = [extract_infohash(url) or None for url in urls]
+        wanted = {x for x in hashes if x}
+        if wanted:
+            # torrent url is fetched by qbittorrent in background,
+            # it's not registered yet but will be registered with this infohash
+            try:
+                registered = {t.hash.lower() for t in self.client.torrents_info(torrent_hashes=list(wanted))}
+            except qbittorrentapi.APIError as e:
+                # torrents are added, infohash of url is still their task id
+                print_warning(f"failed to check added torrents in qbittorrent: {e}")
+                return hashes
+            for h in wanted - registered:
+                print_info(f"torrent {h} is not registered by qbittorrent yet")
+        return hashes
+
+    def health_check(self) -> bool:
+        try:
+            self.client.app_version()
+        except qbittorrentapi.APIError:
+            return False
+        return True
+
+    def add_downloads(self, batch: List[Tuple[str, str]]) -> List[AddDownloadResult]:
+        # qbittorrent accepts many urls in one request, but only one save path
+        urls_by_path: Dict[str, List[str]] = defaultdict(list)
+        for url, save_path in batch:
+            urls_by_path[save_path].append(url)
+
+        errors: Dict[str, Exception] = {}
+        for save_path, urls in urls_by_path.items():
+            try:
+                r = self.client.torrents_add(
+                    urls=urls,
+                    category=cfg.qbittorrent.category,
+                    save_path=save_path,
+                    is_paused=False,
+                    use_auto_torrent_management=False,
+                    tags=cfg.qbittorrent.tags,
+                )
+            except qbittorrentapi.APIError as e:
+                errors[save_path] = e
+                continue
+            if r != "Ok.":
+                errors[save_path] = RpcError(f"qbittorrent failed to add torrents: {r}")
 
-        if info:
-            for torrent in info:
-                if torrent.save_path == save_path:
-                    return torrent.hash
-            return info[-1].hash
-        return None
+        added = [url for url, save_path in batch if save_path not in errors]
+        task_ids = dict(zip(added, self._task_ids(added)))
+
+        return [
+            (
+                AddDownloadResult(error=errors[save_path])
+                if save_path in errors
+                else AddDownloadResult(task_id=task_ids[url])
+            )
+            for url, save_path in batch
+        ]
 
     def get_status(self, id: str) -> DownloadStatus:
         torrent = self.client.torrents.info(torrent_hashes=id)
         if not torrent:
             return DownloadStatus.not_found
-        state_enum: TorrentState = torrent[0].state_enum
+        return self._status(torrent[0].state_enum)
+
+    def get_statuses(self, ids: List[str]) -> Dict[str, DownloadStatus]:
+        if not ids:
+            return {}
+
+        torrents = {t.hash.lower(): t for t in self.client.torrents_info(torrent_hashes=ids)}
+        return {
+            id: self._status(torrents[id.lower()].state_enum) if id.lower() in torrents else DownloadStatus.not_found
+            for id in ids
+        }
+
+    @staticmethod
+    def _status(state_enum: TorrentState) -> DownloadStatus:
         if state_enum.is_complete or state_enum.is_uploading:
             return DownloadStatus.done
         if state_enum.is_errored:
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Dict, List
 
 import transmission_rpc
 
@@ -27,8 +27,28 @@ class TransmissionRPC(BaseDownloadService):
         torrent = self.client.add_torrent(url, **kwargs)
         return torrent.hashString
 
+    def health_check(self) -> bool:
+        try:
+            self.client.get_session()
+        except transmission_rpc.TransmissionError:
+            return False
+        return True
+
     def get_status(self, id: str) -> DownloadStatus:
-        torrent = self.client.get_torrent(id)
+        return self._status(self.client.get_torrent(id))
+
+    def get_statuses(self, ids: List[str]) -> Dict[str, DownloadStatus]:
+        if not ids:
+            return {}
+
+        # missing torrents are not in response
+        torrents = {
+            t.hashString: t for t in self.client.get_torrents(ids, arguments=["id", "hashString", "status", "error"])
+        }
+        return {id: self._status(torrents[id]) if id in torrents else DownloadStatus.not_found for id in ids}
+
+    @staticmethod
+    def _status(torrent: transmission_rpc.Torrent) -> DownloadStatus:
         if torrent.error:
             return DownloadStatus.not_found
         return {
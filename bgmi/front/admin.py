@@ -9,9 +9,10 @@ from tornado.concurrent import run_on_executor
 from tornado.ioloop import IOLoop
 from tornado.web import HTTPError, RequestHandler
 
-from bgmi.front.base import BaseHandler
-from bgmi.lib.controllers import add, cal, cfg, delete, filter_, mark, search, status_, update
+from bgmi.front.base import BaseHandler, app_state
+from bgmi.lib.controllers import add, cal, cfg, delete, episodes, filter_, mark, search, status_, update
 from bgmi.lib.download import download_prepare
+from bgmi.lib.models import get_data_version
 
 ACTION_AUTH = "auth"
 ACTION_STATUS = "status"
@@ -30,6 +31,7 @@ API_MAP_POST: Dict[str, Callable] = {
     "mark": mark,
     "status": status_,
     "filter": filter_,
+    "episodes": episodes,
 }
 
 API_MAP_GET = {
@@ -37,6 +39,11 @@ API_MAP_GET = {
     "config": lambda: {"data": json.loads(cfg.model_dump_json())},
 }
 
+# tables of GET actions' data, their responses are cached by version ETag
+API_GET_TABLES = {
+    "cal": ("bangumi", "followed", "subtitle", "scripts"),
+}
+
 NO_AUTH_ACTION = ("cal", ACTION_AUTH)
 
 
@@ -58,9 +65,16 @@ def auth(f):  # type: ignore
 
 class AdminApiHandler(BaseHandler):
     @auth
-    def get(self, action: str) -> None:
+    async def get(self, action: str) -> None:
+        if action in API_GET_TABLES:
+            version = await self.run_in_executor(get_data_version, *API_GET_TABLES[action])
+            if self.not_modified(version):
+                return
+
         try:
-            result = API_MAP_GET[action]()
+            result = await self.run_in_executor(API_MAP_GET[action])
+        except HTTPError:
+            raise
         except KeyError:
             raise HTTPError(404)
         except Exception:
@@ -69,14 +83,17 @@ class AdminApiHandler(BaseHandler):
         self.finish(self.jsonify(**result))
 
     @auth
-    def post(self, action: str) -> None:
+    async def post(self, action: str) -> None:
         data = self.get_json()
 
         try:
-            result = API_MAP_POST[action](**data)
+            result = await self.run_in_executor(API_MAP_POST[action], **data)
             if result["status"] == "error":
                 raise HTTPError(400)
-        except HTTPError:
+        except HTTPError as e:
+            # timeout of action
+            if e.status_code == 504:
+                raise
             raise HTTPError(400)
         except KeyError:
             raise HTTPError(404)
@@ -113,4 +130,5 @@ class UpdateHandler(BaseHandler):
         if not download:
             download = None
         update(name, download)
+        app_state.invalidate()
         self.lock.release()
@@ -1,9 +1,16 @@
+import asyncio
+import functools
+import hashlib
 import json
 import json.decoder
-import os
-from typing import Any, List, Optional
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
 
 import tornado.web
+from tornado.ioloop import IOLoop
 from tornado.web import HTTPError
 
 from bgmi import __admin_version__, __version__
@@ -14,10 +21,70 @@ from bgmi.utils import normalize_path
 COVER_URL = "/bangumi/cover"
 WEEK = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
 
+T = TypeVar("T")
+
+# database queries, controllers and filesystem walking run here, keep IOLoop responsive
+executor = ThreadPoolExecutor(cfg.http.executor_workers, thread_name_prefix="bgmi-http")
+
+# part of version ETag, config and in-memory states are changed only by restarting server
+_SERVER_ID = secrets.token_hex(8)
+
+
+class AppState:
+    """
+    data shared by all requests, it's rebuilt only if it may be changed.
+
+    Changes are detected by mtime of ``BGMI_PATH/latest`` and database files,
+    so ``bgmi update`` in another process is noticed by web server.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[int, ...]] = None
+        self.latest_version: Optional[str] = None
+        self.patch_list: List[dict] = []
+
+    @staticmethod
+    def _mtime(path: Path) -> int:
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return 0
+
+    def _get_signature(self) -> Tuple[int, ...]:
+        return (
+            self._mtime(BGMI_PATH.joinpath("latest")),
+            self._mtime(cfg.db_path),
+            self._mtime(Path(f"{cfg.db_path}-wal")),
+        )
+
+    def refresh(self) -> "AppState":
+        signature = self._get_signature()
+        with self._lock:
+            if signature == self._signature:
+                return self
+
+            latest = BGMI_PATH.joinpath("latest")
+            self.latest_version = latest.read_text(encoding="utf8").strip() if latest.exists() else None
+
+            patch_list = ScriptRunner().get_models_dict()
+            for i in patch_list:
+                i["cover"] = normalize_path(i["cover"])
+            self.patch_list = patch_list
+            self._signature = signature
+        return self
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._signature = None
+
+
+app_state = AppState()
+
 
 class BaseHandler(tornado.web.RequestHandler):
     patch_list: List[dict] = []
-    latest_version = None
+    latest_version: Optional[str] = None
 
     def get_json(self) -> Any:
         try:
@@ -37,21 +104,53 @@ class BaseHandler(tornado.web.RequestHandler):
         }
         j.update(kwargs)
         self.set_header("content-type", "application/json; charset=utf-8")
-        return json.dumps(j, ensure_ascii=False, indent=2)
+        if self.get_query_argument("pretty", None) is not None:
+            return json.dumps(j, ensure_ascii=False, indent=2)
+        return json.dumps(j, ensure_ascii=False, separators=(",", ":"))
+
+    def not_modified(self, *version: Any) -> bool:
+        """
+        set a strong ETag derived from ``version`` (usually from ``get_data_version``) and request url,
+        response ``304 Not Modified`` if it matches ``If-None-Match`` of request.
+
+        Handler should return without building response if it returns ``True``.
+        If any part of ``version`` is ``None``, nothing is done and tornado
+        will compute ETag from response body as usual.
+        """
+        if any(v is None for v in version):
+            return False
+
+        key = repr((_SERVER_ID, self.latest_version, self.request.uri, *version))
+        self.set_header("Etag", '"' + hashlib.sha1(key.encode()).hexdigest() + '"')
+        if not self.check_etag_header():
+            return False
+
+        self.set_status(304)
+        self.finish()
+        return True
 
     def data_received(self, chunk: bytes) -> None:
         pass
 
+    async def run_in_executor(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        run blocking function in executor, raise 504 if it doesn't finish in ``cfg.http.action_timeout``.
+
+        Timeout only stops waiting, the function keeps running until it returns.
+        """
+        future = IOLoop.current().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+        if not cfg.http.action_timeout:
+            return await future
+        try:
+            return await asyncio.wait_for(future, cfg.http.action_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504)
+
     def __init__(self, *args: Any, **kwargs: Any) -> None:
-        if self.latest_version is None:
-            if os.path.exists(os.path.join(BGMI_PATH, "latest")):
-                with open(os.path.join(BGMI_PATH, "latest"), encoding="utf8") as f:
-                    self.latest_version = f.read().strip()
-
-        runner = ScriptRunner()
-        self.patch_list = runner.get_models_dict()
-        for i in self.patch_list:
-            i["cover"] = normalize_path(i["cover"])
+        # shared by requests, don't modify them
+        state = app_state.refresh()
+        self.latest_version = state.latest_version
+        self.patch_list = state.patch_list
 
         super().__init__(*args, **kwargs)
 
@@ -1,46 +1,15 @@
 import os
-from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List
 
 from bgmi.config import cfg
 from bgmi.front.base import COVER_URL, BaseHandler
-from bgmi.lib.models import STATUS_DELETED, STATUS_END, STATUS_UPDATING, Followed
-from bgmi.utils import bangumi_save_path, normalize_path
+from bgmi.lib.media import media_index
+from bgmi.lib.models import STATUS_DELETED, STATUS_END, STATUS_UPDATING, Followed, get_data_version
+from bgmi.utils import normalize_path
 
 
 def get_player(bangumi_name: str) -> Dict[int, Dict[str, str]]:
-    bangumi_path = bangumi_save_path(bangumi_name)
-
-    if not bangumi_path.exists():
-        return {}
-
-    episode_list = {}
-
-    episodes = [episode.name for episode in bangumi_path.iterdir() if episode.name.isdigit()]
-
-    for episode in episodes:
-        e = find_largest_video_file(bangumi_path.joinpath(episode))
-        if e:
-            episode_list[int(episode)] = {"path": "/" + e}
-
-    return episode_list
-
-
-def find_largest_video_file(top_dir: Path) -> Optional[str]:
-    video_files = []
-    for root, _, files in os.walk(top_dir):
-        for file in files:
-            _, ext = os.path.splitext(file)
-            if ext.lower() in [".mp4", ".mkv", ".webm"]:
-                p = Path(root).joinpath(file)
-                video_files.append((p.stat().st_size, p))
-
-    if not video_files:
-        return None
-
-    video_files.sort(key=lambda x: -x[0])
-
-    return video_files[0][1].relative_to(cfg.save_path).as_posix()
+    return media_index.get_player(bangumi_name)
 
 
 if __name__ == "__main__":
@@ -66,24 +35,46 @@ class IndexHandler(BaseHandler):
         self.finish()
 
 
-class BangumiListHandler(BaseHandler):
-    def get(self, type_: str = "") -> None:
-        data: List[dict] = Followed.get_all_followed(STATUS_DELETED, STATUS_END if type_ == "old" else STATUS_UPDATING)
+def get_bangumi_list(type_: str, patch_list: List[dict]) -> List[dict]:
+    data: List[dict] = Followed.get_all_followed(STATUS_DELETED, STATUS_END if type_ == "old" else STATUS_UPDATING)
+
+    def sorter(_: Dict[str, int]) -> int:
+        return _["updated_time"] if _["updated_time"] else 1
+
+    if type_ == "index":
+        data.extend(dict(x) for x in patch_list)
+        data.sort(key=sorter)
 
-        def sorter(_: Dict[str, int]) -> int:
-            return _["updated_time"] if _["updated_time"] else 1
+    for bangumi in data:
+        bangumi["cover"] = "{}/{}".format(COVER_URL, normalize_path(bangumi["cover"]))
 
-        if type_ == "index":
-            data.extend(self.patch_list)
-            data.sort(key=sorter)
+    data.reverse()
 
-        for bangumi in data:
-            bangumi["cover"] = "{}/{}".format(COVER_URL, normalize_path(bangumi["cover"]))
+    for item in data:
+        item["player"] = get_player(item["bangumi_name"])
 
-        data.reverse()
+    return data
 
-        for item in data:
-            item["player"] = get_player(item["bangumi_name"])
+
+def get_bangumi_names(type_: str, patch_list: List[dict]) -> List[str]:
+    """names of bangumi ``get_bangumi_list`` returns"""
+    data = Followed.get_all_followed(STATUS_DELETED, STATUS_END if type_ == "old" else STATUS_UPDATING)
+    names = [x["bangumi_name"] for x in data]
+    if type_ == "index":
+        names.extend(x["bangumi_name"] for x in patch_list)
+    return names
+
+
+class BangumiListHandler(BaseHandler):
+    async def get(self, type_: str = "") -> None:
+        version = await self.run_in_executor(get_data_version, "bangumi", "followed", "scripts")
+        names = await self.run_in_executor(get_bangumi_names, type_, self.patch_list)
+        # index all bangumi before taking version, or building response changes it
+        media_version = await self.run_in_executor(media_index.refresh, names)
+        if self.not_modified(version, media_version):
+            return
+
+        data = await self.run_in_executor(get_bangumi_list, type_, self.patch_list)
 
         self.write(self.jsonify(data))
         self.finish()
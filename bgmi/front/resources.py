@@ -1,13 +1,17 @@
 import datetime
 import os
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
+from email.utils import parsedate_to_datetime
+from typing import List, NamedTuple, Optional, Tuple, cast
 
 from icalendar import Calendar, Event, Todo
+from tornado.web import HTTPError
 
 from bgmi.config import cfg
 from bgmi.front.base import BaseHandler
 from bgmi.lib.constants import BANGUMI_UPDATE_TIME
-from bgmi.lib.models import Download, Followed
+from bgmi.lib.models import Download, Followed, get_data_version
 
 
 class BangumiHandler(BaseHandler):
@@ -36,68 +40,123 @@ class BangumiHandler(BaseHandler):
             self.finish()
 
 
+RSS_LIMIT = 100
+RSS_MAX_LIMIT = 1000
+# rendered feeds of most recent used (limit, since)
+RSS_CACHE_SIZE = 16
+
+
+class FeedCache(NamedTuple):
+    version: Optional[int]  # data version of download table
+    body: bytes
+    last_modified: int
+
+
 class RssHandler(BaseHandler):
-    def get(self) -> None:
-        data = Download.get_all_downloads()
+    feed_cache: "OrderedDict[Tuple[int, int], FeedCache]" = OrderedDict()
+
+    def get_int_argument(self, name: str, default: int) -> int:
+        try:
+            return int(self.get_query_argument(name, str(default)))
+        except ValueError:
+            raise HTTPError(400)
+
+    async def get(self) -> None:
+        limit = min(max(self.get_int_argument("limit", RSS_LIMIT), 1), RSS_MAX_LIMIT)
+        since = self.get_int_argument("since", 0)
+
+        key = (limit, since)
+        version = await self.run_in_executor(get_data_version, "download")
+        cached = self.feed_cache.get(key)
+        if cached is None or version is None or cached.version != version:
+            data = await self.run_in_executor(Download.get_feed, limit, since)
+            body = self.render_string("templates/download.xml", data=data)
+            # download table may be changed without changing feed, for example, status of downloads
+            if cached is not None and cached.body == body:
+                last_modified = cached.last_modified
+            else:
+                last_modified = int(time.time())
+            cached = FeedCache(version, body, last_modified)
+            self.feed_cache[key] = cached
+            while len(self.feed_cache) > RSS_CACHE_SIZE:
+                self.feed_cache.popitem(last=False)
+        self.feed_cache.move_to_end(key)
+
         self.set_header("Content-Type", "text/xml")
-        self.render("templates/download.xml", data=data)
+        self.set_header("Last-Modified", datetime.datetime.fromtimestamp(cached.last_modified, datetime.timezone.utc))
+
+        if_modified_since = self.request.headers.get("If-Modified-Since")
+        if if_modified_since and not self.request.headers.get("If-None-Match"):
+            try:
+                modified = cached.last_modified > parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                modified = True
+            if not modified:
+                self.set_status(304)
+                self.finish()
+                return
+
+        self.finish(cached.body)
+
+
+def make_calendar(type_: Optional[str], patch_list: List[dict]) -> bytes:
+    cal = Calendar()
+    cal.add("prodid", "-//BGmi Followed Bangumi Calendar//bangumi.ricterz.me//")
+    cal.add("version", "2.0")
+
+    data = Followed.get_all_followed()
+    data.extend(patch_list)
+
+    if type_ is None:
+        bangumi = defaultdict(list)
+
+        for j in data:
+            bangumi[BANGUMI_UPDATE_TIME.index(j["update_time"]) + 1].append(j["bangumi_name"])
+
+        weekday = datetime.datetime.now().weekday()
+        for i, k in enumerate(range(weekday, weekday + 7)):
+            if k % 7 in bangumi:
+                for v in bangumi[k % 7]:
+                    event = Event()
+                    event.add("summary", v)
+                    event.add(
+                        "dtstart",
+                        datetime.datetime.now().date() + datetime.timedelta(i - 1),
+                    )
+                    event.add(
+                        "dtend",
+                        datetime.datetime.now().date() + datetime.timedelta(i - 1),
+                    )
+                    cal.add_component(event)
+    elif type_ == "download":
+        data = [
+            item for item in Download.get_all_downloads() if item["created_time"] and int(item["created_time"]) != 0
+        ]
+        for d in data:
+            todo = Todo()
+            todo.add("summary", f"{d['name']}: {d['episode']}")
+            todo.add("dstart", datetime.datetime.fromtimestamp(int(d["created_time"])))
+            cal.add_component(todo)
+
+    else:
+        data = [bangumi for bangumi in data if bangumi["status"] == 2]
+        for d in data:
+            event = Event()
+            event.add("summary", "Updated: {}".format(d["bangumi_name"]))
+            event.add("dtstart", datetime.datetime.now().date())
+            event.add("dtend", datetime.datetime.now().date())
+            cal.add_component(event)
+
+    cal.add("name", "Bangumi Calendar")
+    cal.add("X-WR-CALNAM", "Bangumi Calendar")
+    cal.add("description", "Followed Bangumi Calendar")
+    cal.add("X-WR-CALDESC", "Followed Bangumi Calendar")
+
+    return cast(bytes, cal.to_ical())
 
 
 class CalendarHandler(BaseHandler):
-    def get(self) -> None:
+    async def get(self) -> None:
         type_ = self.get_argument("type", None)
-
-        cal = Calendar()
-        cal.add("prodid", "-//BGmi Followed Bangumi Calendar//bangumi.ricterz.me//")
-        cal.add("version", "2.0")
-
-        data = Followed.get_all_followed()
-        data.extend(self.patch_list)
-
-        if type_ is None:
-            bangumi = defaultdict(list)
-
-            for j in data:
-                bangumi[BANGUMI_UPDATE_TIME.index(j["update_time"]) + 1].append(j["bangumi_name"])
-
-            weekday = datetime.datetime.now().weekday()
-            for i, k in enumerate(range(weekday, weekday + 7)):
-                if k % 7 in bangumi:
-                    for v in bangumi[k % 7]:
-                        event = Event()
-                        event.add("summary", v)
-                        event.add(
-                            "dtstart",
-                            datetime.datetime.now().date() + datetime.timedelta(i - 1),
-                        )
-                        event.add(
-                            "dtend",
-                            datetime.datetime.now().date() + datetime.timedelta(i - 1),
-                        )
-                        cal.add_component(event)
-        elif type_ == "download":
-            data = [
-                item for item in Download.get_all_downloads() if item["created_time"] and int(item["created_time"]) != 0
-            ]
-            for d in data:
-                todo = Todo()
-                todo.add("summary", f"{d['name']}: {d['episode']}")
-                todo.add("dstart", datetime.datetime.fromtimestamp(int(d["created_time"])))
-                cal.add_component(todo)
-
-        else:
-            data = [bangumi for bangumi in data if bangumi["status"] == 2]
-            for d in data:
-                event = Event()
-                event.add("summary", "Updated: {}".format(d["bangumi_name"]))
-                event.add("dtstart", datetime.datetime.now().date())
-                event.add("dtend", datetime.datetime.now().date())
-                cal.add_component(event)
-
-        cal.add("name", "Bangumi Calendar")
-        cal.add("X-WR-CALNAM", "Bangumi Calendar")
-        cal.add("description", "Followed Bangumi Calendar")
-        cal.add("X-WR-CALDESC", "Followed Bangumi Calendar")
-
-        self.write(cal.to_ical())
+        self.write(await self.run_in_executor(make_calendar, type_, self.patch_list))
         self.finish()
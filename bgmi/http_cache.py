@@ -0,0 +1,145 @@
+"""on-disk http response cache with ETag / Last-Modified revalidation.
+
+Every entry is stored as two files in ``cfg.tmp_path/http_cache``,
+``{key}.json`` for metadata and ``{key}.body`` for raw content,
+key is the sha1 of method, url, params and request body.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from bgmi.config import cfg
+from bgmi.session import session
+from bgmi.utils import write_file_atomic
+
+# response headers to keep, others are dropped
+_STORED_HEADERS = ("content-type", "etag", "last-modified")
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hits = 0  # fresh, no request sent
+        self.revalidated = 0  # server returned 304
+        self.misses = 0
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.revalidated} revalidated, {self.misses} misses"
+
+
+class ResponseCache:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.stats = CacheStats()
+
+    @staticmethod
+    def make_key(method: str, url: str, params: Any = None, data: Any = None, json_body: Any = None) -> str:
+        h = hashlib.sha1()
+        for part in (method.upper(), url, params, data, json_body):
+            h.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            meta: Dict[str, Any] = json.loads(self.path.joinpath(key + ".json").read_text(encoding="utf-8"))
+            meta["content"] = self.path.joinpath(key + ".body").read_bytes()
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def store(self, key: str, response: requests.Response) -> None:
+        meta = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "encoding": response.encoding,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() in _STORED_HEADERS},
+            "stored_at": time.time(),
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(self.path.joinpath(key + ".body"), response.content)
+        write_file_atomic(self.path.joinpath(key + ".json"), json.dumps(meta).encode())
+
+    def touch(self, key: str, meta: Dict[str, Any], headers: "CaseInsensitiveDict[str]") -> None:
+        """mark entry as fresh after a 304 response, with updated validators"""
+        meta = {k: v for k, v in meta.items() if k != "content"}
+        for name in ("etag", "last-modified"):
+            if name in headers:
+                meta["headers"][name] = headers[name]
+        meta["stored_at"] = time.time()
+        write_file_atomic(self.path.joinpath(key + ".json"), json.dumps(meta).encode())
+
+    def request(self, method: str, url: str, ttl: float = 0, **kwargs: Any) -> requests.Response:
+        """
+        send request with shared session, use cached content if it's unchanged.
+
+        :param ttl: cached response younger than ``ttl`` seconds is returned without sending request,
+            older response is revalidated by ``If-None-Match`` and ``If-Modified-Since``.
+
+        returned response has a ``from_cache`` attribute,
+        it's ``True`` if its content is cached content.
+        """
+        if not cfg.enable_http_cache:
+            r = session.request(method, url, **kwargs)
+            r.from_cache = False  # type: ignore[attr-defined]
+            return r
+
+        key = self.make_key(method, url, kwargs.get("params"), kwargs.get("data"), kwargs.get("json"))
+        cached = self.load(key)
+
+        if cached is not None and time.time() - cached["stored_at"] < ttl:
+            self.stats.incr("hits")
+            return self._build_response(cached)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not None:
+            validators = CaseInsensitiveDict(cached["headers"])
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last-modified" in validators:
+                headers["If-Modified-Since"] = validators["last-modified"]
+
+        r = session.request(method, url, headers=headers, **kwargs)
+
+        if cached is not None and r.status_code == 304:
+            self.stats.incr("revalidated")
+            self.touch(key, cached, r.headers)
+            return self._build_response(cached)
+
+        self.stats.incr("misses")
+        r.from_cache = False  # type: ignore[attr-defined]
+        if r.status_code == 200 and (ttl > 0 or "etag" in r.headers or "last-modified" in r.headers):
+            try:
+                self.store(key, r)
+            except OSError:
+                pass
+        return r
+
+    @staticmethod
+    def _build_response(cached: Dict[str, Any]) -> requests.Response:
+        r = requests.Response()
+        r.url = cached["url"]
+        r.status_code = cached["status_code"]
+        r.encoding = cached["encoding"]
+        r.headers = CaseInsensitiveDict(cached["headers"])
+        r._content = cached["content"]  # pylint: disable=protected-access
+        r.from_cache = True  # type: ignore[attr-defined]
+        return r
+
+
+response_cache = ResponseCache(cfg.tmp_path.joinpath("http_cache"))
+
+
+def cached_request(method: str, url: str, ttl: float = 0, **kwargs: Any) -> requests.Response:
+    return response_cache.request(method, url, ttl=ttl, **kwargs)
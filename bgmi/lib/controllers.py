@@ -1,24 +1,31 @@
 import os.path
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from operator import itemgetter
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import filetype
 import requests.exceptions
 
 from bgmi.config import Source, cfg
+from bgmi.http_cache import response_cache
 from bgmi.lib.constants import BANGUMI_UPDATE_TIME, SUPPORT_WEBSITE
-from bgmi.lib.download import Episode, download_prepare
+from bgmi.lib.download import (
+    Episode,
+    download_prepare,
+    enqueue_downloads,
+    process_download_queue,
+    reconcile_downloads,
+)
 from bgmi.lib.fetch import website
 from bgmi.lib.models import (
     FOLLOWED_STATUS,
     STATUS_DELETED,
     STATUS_FOLLOWED,
-    STATUS_NOT_DOWNLOAD,
     STATUS_UPDATED,
     Bangumi,
     DoesNotExist,
-    Download,
+    FetchedEpisode,
     Filter,
     Followed,
     Subtitle,
@@ -39,8 +46,10 @@ from bgmi.utils import (
     print_success,
     print_warning,
 )
+from bgmi.website.model import WebsiteBangumi
 
 ControllerResult = Dict[str, Any]
+FetchResult = Tuple[Optional[WebsiteBangumi], List[Episode]]
 
 
 def add(name: str, episode: Optional[int] = None) -> ControllerResult:
@@ -135,16 +144,14 @@ def filter_(
         followed_filter_obj.regex = regex
 
     followed_filter_obj.save()
-    subtitle_list = [s["name"] for s in Subtitle.get_subtitle_by_id(bangumi_obj.subtitle_group.split(", "))]
+    bangumi_subtitle = bangumi_obj.subtitle_group.split(", ")
+    followed_subtitle = followed_filter_obj.subtitle_group_split
+    subtitle_map = Subtitle.get_subtitle_map(bangumi_subtitle + followed_subtitle)
 
     result["data"] = {
         "name": bangumi_obj.name,
-        "subtitle_group": subtitle_list,
-        "followed": (
-            [s["name"] for s in Subtitle.get_subtitle_by_id(followed_filter_obj.subtitle.split(", "))]
-            if followed_filter_obj.subtitle
-            else []
-        ),
+        "subtitle_group": [subtitle_map[x] for x in bangumi_subtitle if x in subtitle_map],
+        "followed": [subtitle_map[x] for x in followed_subtitle if x in subtitle_map],
         "include": followed_filter_obj.include,
         "exclude": followed_filter_obj.exclude,
         "regex": followed_filter_obj.regex,
@@ -222,12 +229,14 @@ def cal(force_update: bool = False, cover: Optional[List[str]] = None) -> Dict[s
 
     # for web api, return all subtitle group info
     r = weekly_list  # type: Dict[str, List[Dict[str, Any]]]
+    subtitle_map = Subtitle.get_subtitle_map(
+        x for value in weekly_list.values() for bangumi in value for x in bangumi["subtitle_group"].split(", ")
+    )
     for day, value in weekly_list.items():
         for index, bangumi in enumerate(value):
             bangumi["cover"] = normalize_path(bangumi["cover"])
             subtitle_group = [
-                {"name": x["name"], "id": x["id"]}
-                for x in Subtitle.get_subtitle_by_id(bangumi["subtitle_group"].split(", " ""))
+                {"name": subtitle_map[x], "id": x} for x in bangumi["subtitle_group"].split(", ") if x in subtitle_map
             ]
 
             r[day][index]["subtitle_group"] = subtitle_group
@@ -343,6 +352,30 @@ def source(data_source: str) -> ControllerResult:
     return result
 
 
+def fetch_subscriptions(subscriptions: List[Tuple[Bangumi, Filter]]) -> List[Future[FetchResult]]:
+    """
+    fetch episodes of subscriptions concurrently with ``cfg.update_workers`` threads,
+    only episodes newer than stored ones are requested from website.
+
+    Workers only do network requests and won't touch database,
+    caller should apply the results in order after all futures are done.
+    """
+
+    def worker(bangumi_obj: Bangumi, subtitle_list: List[str], since: int) -> FetchResult:
+        print_info(f"fetching {bangumi_obj.name} ...")
+        return website.fetch_bangumi_episodes(
+            bangumi_obj, subtitle_list=subtitle_list, max_page=cfg.max_path, since=since
+        )
+
+    with ThreadPoolExecutor(max_workers=cfg.update_workers) as executor:
+        futures = [
+            executor.submit(worker, bangumi_obj, f.subtitle_group_split, FetchedEpisode.latest_time(bangumi_obj.name))
+            for bangumi_obj, f in subscriptions
+        ]
+
+    return futures
+
+
 def update(names: List[str], download: Optional[bool] = False, not_ignore: bool = False) -> ControllerResult:
     logger.debug("updating bangumi info with args: download: %r", download)
     downloaded: List[Episode] = []
@@ -355,7 +388,6 @@ def update(names: List[str], download: Optional[bool] = False, not_ignore: bool
     ignore = not bool(not_ignore)
     print_info("marking bangumi status ...")
     now = int(time.time())
-    failed = []
 
     for follow in Followed.get_all_followed():
         if follow["updated_time"] and int(follow["updated_time"] + 60 * 60 * 24) < now:
@@ -390,19 +422,11 @@ def update(names: List[str], download: Optional[bool] = False, not_ignore: bool
     runner = ScriptRunner()
     script_download_queue = runner.run()
     if script_download_queue and download:
-        download_prepare(script_download_queue)
+        enqueue_downloads(script_download_queue)
         downloaded.extend(script_download_queue)
-        print_info("downloading ...")
-        download_prepare(
-            [
-                Episode(**{key: value for key, value in x.items() if key not in ["id", "status"]})
-                for x in Download.get_all_downloads(status=STATUS_NOT_DOWNLOAD)
-            ]
-        )
 
+    subscriptions: List[Tuple[Dict[str, Any], Bangumi, Followed, Filter]] = []
     for subscribe in updated_bangumi_obj:
-        download_queue = []
-        print_info(f"fetching {subscribe['bangumi_name']} ...")
         try:
             bangumi_obj = Bangumi.get(name=subscribe["bangumi_name"])
         except Bangumi.DoesNotExist:
@@ -413,15 +437,30 @@ def update(names: List[str], download: Optional[bool] = False, not_ignore: bool
         except Followed.DoesNotExist:
             logger.error("Bangumi<{}> is not followed.", subscribe["bangumi_name"])
             continue
+        followed_filter_obj, _ = Filter.get_or_create(bangumi_name=bangumi_obj.name)
+        subscriptions.append((subscribe, bangumi_obj, followed_obj, followed_filter_obj))
+
+    fetched = fetch_subscriptions(
+        [(bangumi_obj, followed_filter_obj) for _, bangumi_obj, _, followed_filter_obj in subscriptions]
+    )
 
+    # all database writing and downloading happen here, in the order of subscriptions
+    for (subscribe, bangumi_obj, followed_obj, followed_filter_obj), future in zip(subscriptions, fetched):
+        download_queue = []
         try:
-            episode, all_episode_data = website.get_maximum_episode(
-                bangumi=bangumi_obj, ignore_old_row=ignore, max_page=cfg.max_path
-            )
+            info, new_episodes = future.result()
         except requests.exceptions.ConnectionError as e:
             print_warning(f"error {e} to fetch {bangumi_obj.name}, skip")
             continue
 
+        if info is not None:
+            website.save_bangumi(info)
+
+        FetchedEpisode.save_episodes(new_episodes)
+        episode, all_episode_data = FetchedEpisode.get_maximum_episode(
+            bangumi_obj.name, followed_filter_obj, ignore_old_row=ignore
+        )
+
         saved_episode = subscribe.get("episode") or 0
         if episode > saved_episode:
             episode_range = range(saved_episode + 1, episode + 1)
@@ -439,18 +478,41 @@ def update(names: List[str], download: Optional[bool] = False, not_ignore: bool
                         break
 
         if download:
-            download_prepare(download_queue)
+            enqueue_downloads(download_queue)
             downloaded.extend(download_queue)
 
-    if downloaded:
-        failed = [Episode.model_validate(x) for x in Download.get_all_downloads(status=STATUS_NOT_DOWNLOAD)]
-        if failed:
-            print_info("try to re-downloading previous failed torrents ...")
-            download_prepare(failed)
-
     if download:
+        stats = reconcile_downloads()
+        if stats["retry"] or stats["error"]:
+            print_warning("{retry} downloads failed and will be retried, {error} downloads gave up".format(**stats))
+
+        print_info("downloading ...")
+        requested = {(x.name, x.episode, x.download) for x in downloaded}
+        # previous failed downloads which are due to retry
+        failed = [
+            Episode(name=x.name, title=x.title, episode=x.episode, download=x.download)
+            for x in process_download_queue(now)
+            if (x.name, x.episode, x.download) not in requested
+        ]
         hook_runner.post_add_download(download_queue=downloaded, redownload_queue=failed)
 
+    logger.debug("http cache: {}", response_cache.stats)
+    return result
+
+
+def episodes(name: str, not_ignore: bool = False) -> ControllerResult:
+    """episodes of bangumi in local episode store, filter of bangumi is applied"""
+    result: ControllerResult = {"status": "success", "message": "", "data": []}
+    try:
+        bangumi_obj = Bangumi.get(name=name)
+    except Bangumi.DoesNotExist:
+        result["status"] = "error"
+        result["message"] = f"Bangumi {name} does not exist"
+        return result
+
+    followed_filter_obj, _ = Filter.get_or_create(bangumi_name=bangumi_obj.name)
+    _, data = FetchedEpisode.get_maximum_episode(bangumi_obj.name, followed_filter_obj, ignore_old_row=not not_ignore)
+    result["data"] = [e.model_dump() for e in data]
     return result
 
 
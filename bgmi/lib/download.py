@@ -1,53 +1,303 @@
 import os
+import threading
 import time
 import traceback
-from typing import List, cast
+from typing import Dict, List, Optional, Tuple, cast
 
 import stevedore
+from peewee import chunked
 from stevedore.exception import NoMatches
 
 from bgmi import namespace
 from bgmi.config import cfg
-from bgmi.lib.models import STATUS_DOWNLOADING, STATUS_NOT_DOWNLOAD, Download
-from bgmi.plugin.download import BaseDownloadService
-from bgmi.utils import bangumi_save_path, print_error, print_info
+from bgmi.lib.models import (
+    STATUS_DOWNLOAD_ERROR,
+    STATUS_DOWNLOADED,
+    STATUS_DOWNLOADING,
+    STATUS_NOT_DOWNLOAD,
+    Download,
+    db,
+)
+from bgmi.plugin.download import BaseDownloadService, DownloadStatus
+from bgmi.utils import bangumi_save_path, print_error, print_info, print_warning
 from bgmi.website.base import Episode
 
 
+class DownloadDriverRegistry:
+    """
+    keep one client of each download delegate for the whole process.
+
+    Client is created on first use and re-created if its health check fails,
+    health check is skipped if client is checked or used in last ``check_interval`` seconds.
+    """
+
+    def __init__(self, check_interval: float = 60) -> None:
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._drivers: Dict[str, BaseDownloadService] = {}
+        self._checked_at: Dict[str, float] = {}
+
+    def get(self, delegate: str) -> BaseDownloadService:
+        with self._lock:
+            driver = self._drivers.get(delegate)
+            if driver is not None:
+                if time.monotonic() - self._checked_at[delegate] < self.check_interval:
+                    return driver
+                if driver.health_check():
+                    self._checked_at[delegate] = time.monotonic()
+                    return driver
+                print_warning(f"connection to download delegate {delegate} is broken, reconnecting")
+
+            driver = self._load(delegate)
+            self._drivers[delegate] = driver
+            self._checked_at[delegate] = time.monotonic()
+            return driver
+
+    def invalidate(self, delegate: str) -> None:
+        """health check client on next use, call it when client raise unexpected error"""
+        with self._lock:
+            if delegate in self._checked_at:
+                self._checked_at[delegate] = float("-inf")
+
+    @staticmethod
+    def _load(delegate: str) -> BaseDownloadService:
+        try:
+            return cast(
+                BaseDownloadService,
+                stevedore.DriverManager(namespace.DOWNLOAD_DELEGATE, name=delegate, invoke_on_load=True).driver,
+            )
+        except NoMatches:
+            print_error(f"can't load download delegate {delegate}")
+            raise
+
+
+drivers = DownloadDriverRegistry()
+
+
 def get_download_driver(delegate: str) -> BaseDownloadService:
-    try:
-        return cast(
-            BaseDownloadService,
-            stevedore.DriverManager(namespace.DOWNLOAD_DELEGATE, name=delegate, invoke_on_load=True).driver,
-        )
-    except NoMatches:
-        print_error(f"can't load download delegate {delegate}")
-        raise
+    return drivers.get(delegate)
 
 
 def download_prepare(data: List[Episode]) -> None:
+    """save episodes to download queue and send them to download delegate at once"""
+    dispatch_downloads(save_to_bangumi_download_queue(data))
+
+
+def enqueue_downloads(data: List[Episode]) -> List[Download]:
+    """
+    save episodes to download queue as due jobs, ``process_download_queue`` sends them to download delegate.
+
+    Saved episodes which are downloading or downloaded are left as they are.
+    """
     queue = save_to_bangumi_download_queue(data)
+    pending = [x.id for x in queue if x.status in (STATUS_NOT_DOWNLOAD, STATUS_DOWNLOAD_ERROR)]
+    Download.set_status(pending, STATUS_NOT_DOWNLOAD, next_attempt_time=0)
+    return queue
+
+
+def dispatch_downloads(queue: List[Download]) -> None:
+    """send downloads to download delegate in one batch, failed ones are retried later"""
+    if not queue:
+        return
+
     driver = get_download_driver(cfg.download_delegate)
+
+    # mark as downloading
+    created_time = int(time.time())
+    Download.set_status([x.id for x in queue], STATUS_DOWNLOADING, created_time=created_time)
+
+    batch = []
     for download in queue:
-        download.created_time = int(time.time())
+        download.status = STATUS_DOWNLOADING
+        download.created_time = created_time
         save_path = bangumi_save_path(download.name).joinpath(str(download.episode))
         if not save_path.exists():
             os.makedirs(save_path)
+        batch.append((download.download, str(save_path)))
 
-        # mark as downloading
-        download.status = STATUS_DOWNLOADING
-        download.save()
+    try:
+        results = driver.add_downloads(batch)
+    except Exception as e:
+        if os.getenv("DEBUG"):  # pragma: no cover
+            raise
+        print_error(f"Error when adding downloads to download delegate: {e}", stop=False)
+        drivers.invalidate(cfg.download_delegate)
+        retry_later(queue, created_time)
+        return
+
+    failed = []
+    added = []
+    for download, (_, path), result in zip(queue, batch, results):
+        if result.error is None:
+            print_info("Add torrent into the download queue, " f"the file will be saved at {path}")
+            download.task_id = result.task_id
+            added.append(download)
+            continue
+
+        if os.getenv("DEBUG"):  # pragma: no cover
+            traceback.print_exception(result.error)
+            raise result.error
+
+        print_error(f"Error when downloading {download.title}: {result.error}", stop=False)
+        failed.append(download)
+
+    with db.atomic():
+        if added:
+            Download.bulk_update(added, fields=[Download.task_id], batch_size=100)
+        if failed:
+            drivers.invalidate(cfg.download_delegate)
+            retry_later(failed, created_time)
+
+
+# failed download is retried after ``RETRY_DELAY * 2 ** (attempts - 1)`` seconds, at most ``MAX_RETRY_DELAY``
+RETRY_DELAY = 10 * 60
+MAX_RETRY_DELAY = 24 * 60 * 60
+MAX_ATTEMPTS = 5
+
+
+def retry_delay(attempts: int) -> int:
+    return int(min(RETRY_DELAY * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY))
+
+
+def retry_later(downloads: List[Download], now: int) -> int:
+    """
+    put failed downloads back to download queue with exponential backoff,
+    downloads failed ``MAX_ATTEMPTS`` times are marked as ``STATUS_DOWNLOAD_ERROR``.
+
+    :return: count of downloads given up
+    """
+    given_up = 0
+    for download in downloads:
+        download.attempts += 1
+        download.task_id = None
+        if download.attempts >= MAX_ATTEMPTS:
+            print_warning(f"{download.title} failed {download.attempts} times, give up")
+            download.status = STATUS_DOWNLOAD_ERROR
+            given_up += 1
+        else:
+            download.status = STATUS_NOT_DOWNLOAD
+            download.next_attempt_time = now + retry_delay(download.attempts)
+
+    Download.bulk_update(
+        downloads,
+        fields=[Download.status, Download.task_id, Download.attempts, Download.next_attempt_time],
+        batch_size=100,
+    )
+    return given_up
+
+
+def process_download_queue(now: Optional[int] = None) -> List[Download]:
+    """
+    send due downloads in queue to download delegate, oldest first.
+
+    If ``cfg.max_active_downloads`` is set, only free slots are filled,
+    a task is active until ``reconcile_downloads`` sees it finished or failed.
+
+    :return: downloads sent to download delegate
+    """
+    now = int(time.time()) if now is None else now
+    query = Download.due(now)
+
+    if cfg.max_active_downloads:
+        slots = cfg.max_active_downloads - Download.count_active()
+        if slots <= 0:
+            return []
+        query = query.limit(slots)
+
+    queue = list(query)
+    for batch in chunked(queue, 100):
+        dispatch_downloads(batch)
+    return queue
+
+
+# downloading task without task id can't be queried from download delegate,
+# it's put back to download queue if nothing is saved after this many seconds
+UNTRACKED_TIMEOUT = 24 * 60 * 60
+
+
+def _saved(download: Download) -> bool:
+    """if any file of episode is in save path"""
+    path = bangumi_save_path(download.name).joinpath(str(download.episode))
+    return path.is_dir() and any(x.is_file() for x in path.rglob("*"))
+
+
+def _settle(done: List[int], failed: List[Download], now: int, stats: Dict[str, int]) -> None:
+    """mark finished downloads as downloaded and put failed ones back to queue"""
+    with db.atomic():
+        Download.set_status(done, STATUS_DOWNLOADED)
+        if failed:
+            given_up = retry_later(failed, now)
+            stats["error"] += given_up
+            stats["retry"] += len(failed) - given_up
+    stats["downloaded"] += len(done)
+
+
+def reconcile_downloads(delegate: Optional[str] = None, batch_size: int = 100) -> Dict[str, int]:
+    """
+    sync status of downloading tasks from download delegate,
+    status of each batch is queried with one ``get_task_statuses`` call.
+
+    Finished tasks are marked as downloaded, failed ones are put back to
+    download queue with exponential backoff, until they fail ``MAX_ATTEMPTS`` times.
+
+    Download delegate may forget finished tasks (aria2) or user may remove them,
+    so a missing task is marked as downloaded if its files are saved, or left as it is.
+    Tasks without task id are put back to queue after ``UNTRACKED_TIMEOUT`` if nothing is saved.
+    Task continued by a new task (aria2 magnet link) is tracked by id of the new one.
+
+    :return: count of ``downloaded``, ``retry``, ``error``, ``downloading`` and ``missing`` tasks
+    """
+    delegate = delegate or cfg.download_delegate
+    driver = get_download_driver(delegate)
+    stats = {"downloaded": 0, "retry": 0, "error": 0, "downloading": 0, "missing": 0}
+
+    now = int(time.time())
+    untracked = list(
+        Download.select().where(
+            (Download.status == STATUS_DOWNLOADING)
+            & Download.task_id.is_null()
+            & (Download.created_time <= now - UNTRACKED_TIMEOUT)
+        )
+    )
+    done = [x.id for x in untracked if _saved(x)]
+    _settle(done, [x for x in untracked if x.id not in done], now, stats)
+
+    downloads = list(Download.select().where((Download.status == STATUS_DOWNLOADING) & Download.task_id.is_null(False)))
+    for batch in chunked(downloads, batch_size):
         try:
-            driver.add_download(url=download.download, save_path=str(save_path))
-            print_info("Add torrent into the download queue, " f"the file will be saved at {save_path}")
+            statuses = driver.get_task_statuses([x.task_id for x in batch])
         except Exception as e:
-            if os.getenv("DEBUG"):  # pragma: no cover
-                traceback.print_exc()
-                raise e
+            drivers.invalidate(delegate)
+            print_warning(f"failed to get status of downloading tasks: {e}")
+            break
 
-            print_error(f"Error when downloading {download.title}: {e}", stop=False)
-            download.status = STATUS_NOT_DOWNLOAD
-            download.save()
+        now = int(time.time())
+        done = []
+        failed = []
+        followed = []
+        for download in batch:
+            task = statuses.get(download.task_id)
+            status = task.status if task else None
+            if task and task.followed_by:
+                download.task_id = task.followed_by
+                followed.append(download)
+            if status == DownloadStatus.done:
+                done.append(download.id)
+            elif status == DownloadStatus.error:
+                failed.append(download)
+            elif status == DownloadStatus.not_found:
+                if _saved(download):
+                    done.append(download.id)
+                else:
+                    stats["missing"] += 1
+            else:
+                stats["downloading"] += 1
+
+        if followed:
+            Download.bulk_update(followed, fields=[Download.task_id], batch_size=100)
+        _settle(done, failed, now, stats)
+
+    return stats
 
 
 def save_to_bangumi_download_queue(data: List[Episode]) -> List[Download]:
@@ -59,19 +309,57 @@ def save_to_bangumi_download_queue(data: List[Episode]) -> List[Download]:
     episode:int, episode of bangumi
     download:str, link to download
     }
+
+    Episodes are saved in batches, an episode which is already saved
+    (same name, episode and download link, or same infohash) reuses its row.
+    Episode is skipped if same release is downloading or downloaded by another link.
+
     :param data:
     :return:
     """
-    queue = []
+    episodes: Dict[Tuple[str, int, str], Episode] = {}
+    # episodes with same infohash share the key of first one
+    key_of_hash: Dict[str, Tuple[str, int, str]] = {}
     for i in data:
-        download, _ = Download.get_or_create(
-            title=i.title,
-            download=i.download,
-            name=i.name,
-            episode=i.episode,
-            status=STATUS_NOT_DOWNLOAD,
-        )
+        key = (i.name, i.episode, i.download)
+        if i.infohash:
+            key = key_of_hash.setdefault(i.infohash, key)
+        episodes.setdefault(key, i)
 
-        queue.append(download)
+    stored: Dict[Tuple[str, int, str], Download] = {}
+    with db.atomic():
+        by_hash: Dict[str, Download] = {}
+        for hashes in chunked(key_of_hash, 500):
+            for download in Download.select().where(Download.infohash.in_(hashes)).order_by(Download.id):
+                by_hash.setdefault(download.infohash, download)
+        skipped = set()
+        for key, i in episodes.items():
+            download = by_hash.get(i.infohash)
+            if download is None:
+                continue
+            if download.download != i.download and download.status in (STATUS_DOWNLOADING, STATUS_DOWNLOADED):
+                print_info(f"{i.title} is already downloaded by another link, skip")
+                skipped.add(key)
+            else:
+                stored[key] = download
 
-    return queue
+        new_episodes = [i for key, i in episodes.items() if key not in stored and key not in skipped]
+        rows = [
+            {
+                Download.title: i.title,
+                Download.download: i.download,
+                Download.name: i.name,
+                Download.episode: i.episode,
+                Download.status: STATUS_NOT_DOWNLOAD,
+                Download.infohash: i.infohash,
+            }
+            for i in new_episodes
+        ]
+        for batch in chunked(rows, 100):
+            Download.insert_many(batch).on_conflict_ignore().execute()
+
+        for links in chunked({i.download for i in new_episodes}, 500):
+            for download in Download.select().where(Download.download.in_(links)):
+                stored.setdefault((download.name, download.episode, download.download), download)
+
+    return [stored[key] for key in episodes if key not in skipped]
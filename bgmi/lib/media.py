@@ -0,0 +1,195 @@
+"""index of video files in bangumi save path, for the player of web ui.
+
+Index is kept in memory and saved to ``cfg.tmp_path/media_index.json``.
+Each episode directory keeps mtime of itself and its sub directories,
+it's walked again only when any of them changed, so a request usually
+costs a few ``stat`` calls instead of walking the whole library.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from bgmi.config import cfg
+from bgmi.utils import bangumi_save_path, write_file_atomic
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm")
+
+# bump it when format of saved index changed
+_INDEX_VERSION = 1
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def scan_episode(episode_dir: Path) -> Dict[str, Any]:
+    """
+    walk an episode directory
+
+    :return: ``dirs``, mtime of directories, and ``files``, list of ``(path, size, mtime)`` of video files
+    """
+    dirs: Dict[str, int] = {}
+    files: List[Tuple[str, int, int]] = []
+    for root, _, names in os.walk(episode_dir):
+        root_mtime = _mtime(Path(root))
+        if root_mtime is not None:
+            dirs[root] = root_mtime
+        for name in names:
+            if os.path.splitext(name)[1].lower() not in VIDEO_EXTENSIONS:
+                continue
+            try:
+                stat = Path(root).joinpath(name).stat()
+            except OSError:
+                continue
+            files.append(
+                (Path(root).joinpath(name).relative_to(cfg.save_path).as_posix(), stat.st_size, stat.st_mtime_ns)
+            )
+    return {"dirs": dirs, "files": files}
+
+
+class MediaIndex:
+    def __init__(self, path: Path, check_interval: float = 10) -> None:
+        """
+        :param path: file to save index
+        :param check_interval: mtime of a bangumi isn't checked again within ``check_interval`` seconds
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._bangumi: Optional[Dict[str, Dict[str, Any]]] = None
+        self._checked_at: Dict[str, float] = {}
+        # increased when index is changed, in memory only
+        self.version = 0
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._bangumi is None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self._bangumi = data["bangumi"] if data.get("version") == _INDEX_VERSION else {}
+            except (OSError, ValueError, KeyError):
+                self._bangumi = {}
+        return self._bangumi
+
+    def _save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_file_atomic(
+                self.path,
+                json.dumps({"version": _INDEX_VERSION, "bangumi": self._bangumi}, ensure_ascii=False).encode(),
+            )
+        except OSError as e:
+            logger.warning("failed to save media index: {}", e)
+
+    @staticmethod
+    def _changed(episode: Optional[Dict[str, Any]]) -> bool:
+        if episode is None:
+            return True
+        return any(_mtime(Path(d)) != mtime for d, mtime in episode["dirs"].items())
+
+    def _update(self, bangumi_path: Path, force: bool = False) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """update index of a bangumi directory, return its entry and if it's changed"""
+        index = self._load()
+        key = str(bangumi_path)
+        self._checked_at[key] = time.monotonic()
+
+        mtime = _mtime(bangumi_path)
+        if mtime is None:
+            removed = index.pop(key, None) is not None
+            if removed:
+                self.version += 1
+            return None, removed
+
+        entry = index.get(key)
+        changed = False
+        if force or entry is None or entry["mtime"] != mtime:
+            old = {} if force or entry is None else entry["episodes"]
+            episodes = {x.name: old.get(x.name) for x in bangumi_path.iterdir() if x.name.isdigit() and x.is_dir()}
+            entry = {"mtime": mtime, "episodes": episodes}
+            index[key] = entry
+            changed = True
+
+        for name, episode in entry["episodes"].items():
+            if self._changed(episode):
+                entry["episodes"][name] = scan_episode(bangumi_path.joinpath(name))
+                changed = True
+
+        if changed:
+            self.version += 1
+        return entry, changed
+
+    def _outdated(self, key: str) -> bool:
+        return time.monotonic() - self._checked_at.get(key, float("-inf")) >= self.check_interval
+
+    def get_player(self, bangumi_name: str) -> Dict[int, Dict[str, str]]:
+        """largest video file of each episode of bangumi"""
+        bangumi_path = bangumi_save_path(bangumi_name)
+        key = str(bangumi_path)
+
+        with self._lock:
+            index = self._load()
+            entry = index.get(key)
+            if entry is None or self._outdated(key):
+                start = time.perf_counter()
+                entry, changed = self._update(bangumi_path)
+                if changed:
+                    logger.debug("media index of {} updated in {:.3f}s", bangumi_name, time.perf_counter() - start)
+                    self._save()
+
+            if entry is None:
+                return {}
+
+            player = {}
+            for name, episode in entry["episodes"].items():
+                if episode["files"]:
+                    path, _, _ = max(episode["files"], key=lambda x: x[1])
+                    player[int(name)] = {"path": "/" + path}
+            return player
+
+    def refresh(self, bangumi_names: Iterable[str] = ()) -> int:
+        """
+        check indexed bangumi not checked in ``check_interval`` seconds,
+        and index ``bangumi_names`` not indexed yet, return version of index.
+
+        Pass all bangumi a response will include, so building it doesn't change version of index.
+        """
+        with self._lock:
+            keys = dict.fromkeys(self._load())
+            keys.update(dict.fromkeys(str(bangumi_save_path(name)) for name in bangumi_names))
+            changed = False
+            for key in [k for k in keys if self._outdated(k)]:
+                changed = self._update(Path(key))[1] or changed
+            if changed:
+                self._save()
+            return self.version
+
+    def rescan(self, bangumi_names: Iterable[str]) -> Dict[str, int]:
+        """
+        rebuild index of bangumi, entries of other bangumi are dropped.
+
+        :return: count of ``bangumi``, ``episodes`` and ``files`` in index
+        """
+        with self._lock:
+            self._bangumi = {}
+            self._checked_at.clear()
+            for name in bangumi_names:
+                self._update(bangumi_save_path(name), force=True)
+            self._save()
+
+            episodes = [e for b in self._bangumi.values() for e in b["episodes"].values()]
+            return {
+                "bangumi": len(self._bangumi),
+                "episodes": len(episodes),
+                "files": sum(len(e["files"]) for e in episodes),
+            }
+
+
+media_index = MediaIndex(cfg.tmp_path.joinpath("media_index.json"))
@@ -1,7 +1,8 @@
 import os
 import time
 from collections import defaultdict
-from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Type, TypeVar
 
 import peewee
 from peewee import FixedCharField, IntegerField, TextField
@@ -27,11 +28,13 @@ FOLLOWED_STATUS = (STATUS_DELETED, STATUS_FOLLOWED, STATUS_UPDATED)
 STATUS_NOT_DOWNLOAD = 0
 STATUS_DOWNLOADING = 1
 STATUS_DOWNLOADED = 2
-DOWNLOAD_STATUS = (STATUS_NOT_DOWNLOAD, STATUS_DOWNLOADING, STATUS_DOWNLOADED)
+STATUS_DOWNLOAD_ERROR = 3  # failed too many times, won't be retried
+DOWNLOAD_STATUS = (STATUS_NOT_DOWNLOAD, STATUS_DOWNLOADING, STATUS_DOWNLOADED, STATUS_DOWNLOAD_ERROR)
 
 DoesNotExist = peewee.DoesNotExist
 
-db = peewee.SqliteDatabase(cfg.db_path)
+# pragmas are executed on every new connection
+db = peewee.SqliteDatabase(cfg.db_path, pragmas=cfg.database.pragmas())
 
 if os.environ.get("DEV"):
     print(f"using database {cfg.db_path}")
@@ -62,6 +65,11 @@ class Bangumi(NeoDB):
     update_time = FixedCharField(5, null=False)
     cover = TextField()
     status = IntegerField(default=0)
+    # calendar refresh which saw this bangumi last time
+    generation = IntegerField(default=0)
+
+    class Meta:
+        indexes = ((("status", "update_time"), False),)
 
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
@@ -82,16 +90,26 @@ class Bangumi(NeoDB):
             self.subtitle_group = ", ".join(sorted(s))
 
     @classmethod
-    def delete_all(cls) -> None:
-        un_updated_bangumi: List[Followed] = Followed.select().where(
+    def delete_all(cls, generation: Optional[int] = None) -> None:
+        """
+        mark bangumi as STATUS_END, except bangumi updated in last 2 weeks.
+
+        :param generation: only mark bangumi not seen in this calendar refresh
+        """
+        recently_updated = Followed.select(Followed.bangumi_name).where(
             Followed.updated_time > (int(time.time()) - 2 * 7 * 24 * 3600)
         )
         if os.getenv("DEBUG"):  # pragma: no cover
-            print("ignore updating bangumi", [x.bangumi_name for x in un_updated_bangumi])
+            print("ignore updating bangumi", [x.bangumi_name for x in recently_updated])
 
-        cls.update(status=STATUS_END).where(
-            cls.name.not_in([x.bangumi_name for x in un_updated_bangumi])
-        ).execute()  # do not mark updating bangumi as STATUS_END
+        q = cls.update(status=STATUS_END).where(cls.name.not_in(recently_updated))
+        if generation is not None:
+            q = q.where(cls.generation < generation)
+        q.execute()  # do not mark updating bangumi as STATUS_END
+
+    @classmethod
+    def next_generation(cls) -> int:
+        return (cls.select(peewee.fn.MAX(cls.generation)).scalar() or 0) + 1
 
     @classmethod
     def get_updating_bangumi(cls, status: Optional[int] = None, order: bool = True) -> Any:
@@ -155,6 +173,7 @@ class Followed(NeoDB):
     class Meta:
         database = db
         table_name = "followed"
+        indexes = ((("status", "updated_time"), False),)
 
     @classmethod
     def delete_followed(cls, batch: bool = True) -> bool:
@@ -187,6 +206,17 @@ class Download(NeoDB):
     download = TextField()
     status = IntegerField(default=0)
     created_time = IntegerField(default=0)
+    task_id = TextField(null=True)  # task id in download delegate
+    attempts = IntegerField(default=0)  # failed attempts of downloading
+    next_attempt_time = IntegerField(default=0)  # don't retry before it
+    infohash = TextField(default="", index=True)  # empty if it's unknown
+
+    class Meta:
+        indexes = (
+            (("status", "created_time"), False),
+            (("status", "next_attempt_time"), False),
+            (("name", "episode", "download"), True),
+        )
 
     @classmethod
     def get_all_downloads(cls, status: Optional[int] = None) -> List[dict]:
@@ -199,10 +229,133 @@ class Download(NeoDB):
             data[index] = model_to_dict(x)
         return data
 
+    @classmethod
+    def due(cls, now: int) -> peewee.ModelSelect:
+        """downloads waiting in queue and ready to (re)try, oldest first"""
+        return (
+            cls.select()
+            .where((cls.status == STATUS_NOT_DOWNLOAD) & (cls.next_attempt_time <= now))
+            .order_by(cls.next_attempt_time, cls.id)
+        )
+
+    @classmethod
+    def count_active(cls) -> int:
+        """downloads sent to download delegate and not finished yet, including ones without task id"""
+        return int(cls.select().where(cls.status == STATUS_DOWNLOADING).count())
+
+    @classmethod
+    def get_feed(cls, limit: int, since: int = 0) -> List[dict]:
+        """title and link of latest ``limit`` downloads created after ``since``, newest first"""
+        q = cls.select(cls.title, cls.download, cls.created_time)
+        if since:
+            q = q.where(cls.created_time > since)
+        return list(q.order_by(cls.created_time.desc(), cls.id.desc()).limit(limit).dicts())
+
     def downloaded(self) -> None:
         self.status = STATUS_DOWNLOADED
         self.save()
 
+    @classmethod
+    def set_status(cls, id_list: List[int], status: int, **fields: Any) -> None:
+        """update status (and other fields) of many downloads in one transaction"""
+        with db.atomic():
+            for batch in peewee.chunked(id_list, 500):
+                cls.update(status=status, **fields).where(cls.id.in_(batch)).execute()
+
+
+class FetchedEpisode(NeoDB):
+    """episodes fetched from data source, updating only need to fetch items newer than stored ones"""
+
+    bangumi_name = TextField(null=False)
+    title = TextField(null=False)
+    episode = IntegerField(default=0)
+    download = TextField()
+    subtitle_group = TextField(default="")
+    time = IntegerField(default=0)
+    infohash = TextField(default="")
+
+    class Meta:
+        database = db
+        table_name = "episode"
+        indexes = (
+            (("bangumi_name", "episode", "time"), False),
+            # same release may be found by keyword of different bangumi
+            (("bangumi_name", "download"), True),
+        )
+
+    @classmethod
+    def save_episodes(cls, episodes: List[Episode]) -> int:
+        """insert episodes which are not stored yet for their bangumi, return count of new rows"""
+        rows: Dict[Tuple[str, str], Episode] = {}
+        for e in episodes:
+            rows.setdefault((e.name, e.download), e)
+
+        stored: Set[Tuple[str, str]] = set()
+        for batch in peewee.chunked({download for _, download in rows}, 500):
+            stored.update(
+                (x.bangumi_name, x.download)
+                for x in cls.select(cls.bangumi_name, cls.download).where(cls.download.in_(batch))
+            )
+
+        new_rows = [
+            {
+                "bangumi_name": e.name,
+                "title": e.title,
+                "episode": e.episode,
+                "download": e.download,
+                "subtitle_group": e.subtitle_group or "",
+                "time": e.time,
+                "infohash": e.infohash,
+            }
+            for key, e in rows.items()
+            if key not in stored
+        ]
+
+        with db.atomic():
+            for batch in peewee.chunked(new_rows, 100):
+                cls.insert_many(batch).on_conflict_ignore().execute()
+
+        return len(new_rows)
+
+    @classmethod
+    def latest_time(cls, bangumi_name: str) -> int:
+        return cls.select(peewee.fn.MAX(cls.time)).where(cls.bangumi_name == bangumi_name).scalar() or 0
+
+    @classmethod
+    def get_episodes(
+        cls, bangumi_name: str, subtitle_list: Optional[List[str]] = None, since: int = 0
+    ) -> List[Episode]:
+        """stored episodes of bangumi published after ``since``, newest first"""
+        q = cls.select().where((cls.bangumi_name == bangumi_name) & (cls.time > since))
+        if subtitle_list:
+            q = q.where(cls.subtitle_group.in_(subtitle_list))
+
+        return [
+            Episode(
+                name=x.bangumi_name,
+                title=x.title,
+                episode=x.episode,
+                download=x.download,
+                subtitle_group=x.subtitle_group,
+                time=x.time,
+                infohash=x.infohash,
+            )
+            for x in q.order_by(cls.time.desc(), cls.id)
+        ]
+
+    @classmethod
+    def get_maximum_episode(
+        cls, bangumi_name: str, followed_filter: "Filter", ignore_old_row: bool = True
+    ) -> Tuple[int, List[Episode]]:
+        """apply filter of bangumi on stored episodes, return max episode and episodes"""
+        since = int(time.time()) - 3600 * 24 * 30 * 3 if ignore_old_row else 0  # three month
+        data = followed_filter.apply_on_episodes(
+            cls.get_episodes(bangumi_name, subtitle_list=followed_filter.subtitle_group_split, since=since)
+        )
+        if not data:
+            return 0, []
+        return max(e.episode for e in data), data
+
 
 class Filter(NeoDB):
     bangumi_name = TextField(unique=True)  # type: Optional[str]
@@ -248,6 +401,14 @@ class Subtitle(NeoDB):
             data[index] = model_to_dict(subtitle)
         return data
 
+    @classmethod
+    def get_subtitle_map(cls, id_list: Iterable[str]) -> Dict[str, str]:
+        """resolve names of many subtitle groups at once, return a dict of ``{id: name}``"""
+        subtitle_map: Dict[str, str] = {}
+        for batch in peewee.chunked({x for x in id_list if x}, 500):
+            subtitle_map.update(cls.select(cls.id, cls.name).where(cls.id.in_(batch)).tuples())
+        return subtitle_map
+
     @classmethod
     def get_subtitle_by_name(cls, name_list: List[str]) -> List[Dict[str, str]]:
         data = list(cls.select().where(cls.name.in_(name_list)))
@@ -263,6 +424,69 @@ class Scripts(NeoDB):
     updated_time = IntegerField(default=0)
 
 
+# every write to these tables bumps its counter in ``data_version`` table, by triggers.
+# Web server use counters as ETag, so unchanged responses don't need to be built again.
+VERSIONED_TABLES = ("bangumi", "followed", "subtitle", "filter", "download", "scripts", "episode")
+
+
+def create_data_version_triggers(database: peewee.SqliteDatabase = db) -> None:
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "data_version" ("name" TEXT NOT NULL PRIMARY KEY, "version" INTEGER NOT NULL)'
+    )
+    existing = set(database.get_tables())
+    for table in VERSIONED_TABLES:
+        if table not in existing:
+            continue
+        database.execute_sql('INSERT OR IGNORE INTO "data_version" ("name", "version") VALUES (?, 0)', (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            database.execute_sql(
+                f'CREATE TRIGGER IF NOT EXISTS "{table}_{event.lower()}_version" AFTER {event} ON "{table}" '
+                f'BEGIN UPDATE "data_version" SET "version" = "version" + 1 WHERE "name" = \'{table}\'; END'
+            )
+
+
+def get_data_version(*tables: str) -> Optional[int]:
+    """
+    sum of write counters of ``tables``, it only increases when tables are changed.
+
+    return ``None`` if counters are not created yet, before migrating database.
+    """
+    try:
+        return int(
+            db.execute_sql(
+                'SELECT COALESCE(SUM("version"), 0) FROM "data_version" WHERE "name" IN ({})'.format(
+                    ", ".join("?" * len(tables))
+                ),
+                tables,
+            ).fetchone()[0]
+        )
+    except peewee.OperationalError:
+        return None
+
+
+def get_database_stats() -> Dict[str, Any]:
+    wal = Path(f"{cfg.db_path}-wal")
+    return {
+        "journal_mode": db.journal_mode,
+        "page_size": db.page_size,
+        "page_count": db.execute_sql("PRAGMA page_count").fetchone()[0],
+        "freelist_count": db.execute_sql("PRAGMA freelist_count").fetchone()[0],
+        "database_size": cfg.db_path.stat().st_size if cfg.db_path.exists() else 0,
+        "wal_size": wal.stat().st_size if wal.exists() else 0,
+    }
+
+
+def optimize_database() -> Tuple[int, int, int]:
+    """
+    run ``PRAGMA optimize`` and truncate WAL file.
+
+    :return: result of ``wal_checkpoint``, (busy, WAL pages, checkpointed pages)
+    """
+    db.execute_sql("PRAGMA optimize")
+    busy, wal_pages, checkpointed = db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return busy, wal_pages, checkpointed
+
+
 def recreate_source_relatively_table() -> None:
     table_to_drop = [
         Bangumi,
@@ -270,6 +494,7 @@ def recreate_source_relatively_table() -> None:
         Subtitle,
         Filter,
         Download,
+        FetchedEpisode,
     ]  # type: List[Type[NeoDB]]
     for table in table_to_drop:
         table.delete().execute()  # pylint: disable=no-value-for-parameter
@@ -1,11 +1,15 @@
 import sqlite3
 from pathlib import Path
+from typing import Callable, List
 
+import peewee
 import semver
 
 from bgmi import __version__
 from bgmi.config import BGMI_PATH, cfg
+from bgmi.lib.models import FetchedEpisode, create_data_version_triggers, db
 from bgmi.utils import COLOR_END, RED, print_error, print_info
+from bgmi.website.model import extract_infohash
 
 old_version_file = BGMI_PATH.joinpath("old")
 
@@ -21,6 +25,130 @@ def exec_sql(sql: str, db: Path = cfg.db_path) -> None:
         print_error("Execute SQL statement failed", stop=False)
 
 
+Migration = Callable[[peewee.SqliteDatabase], None]
+
+# schema migrations, applied in order inside a transaction each.
+# Version of database is count of applied migrations, saved as ``PRAGMA user_version``.
+# Append new migration to the end, never change or reorder existing ones.
+# Tables of fresh install are created by ``init_db``, so migrations must be idempotent.
+MIGRATIONS: List[Migration] = []
+
+
+def migration(f: Migration) -> Migration:
+    MIGRATIONS.append(f)
+    return f
+
+
+@migration
+def add_episode_table(database: peewee.SqliteDatabase) -> None:
+    """add table of fetched episodes"""
+    with FetchedEpisode.bind_ctx(database):
+        FetchedEpisode.create_table(safe=True)
+
+
+@migration
+def add_hot_query_indexes(database: peewee.SqliteDatabase) -> None:
+    """add indexes for bangumi and download list"""
+    # same names as indexes created by peewee from ``Meta.indexes`` of models
+    for sql in [
+        'CREATE INDEX IF NOT EXISTS "bangumi_status_update_time" ON "bangumi" ("status", "update_time")',
+        'CREATE INDEX IF NOT EXISTS "followed_status_updated_time" ON "followed" ("status", "updated_time")',
+        'CREATE INDEX IF NOT EXISTS "download_status_created_time" ON "download" ("status", "created_time")',
+        'CREATE INDEX IF NOT EXISTS "download_name_episode" ON "download" ("name", "episode")',
+    ]:
+        database.execute_sql(sql)
+
+
+@migration
+def add_bangumi_generation(database: peewee.SqliteDatabase) -> None:
+    """add generation of calendar refresh to bangumi"""
+    if "generation" not in [x.name for x in database.get_columns("bangumi")]:
+        database.execute_sql('ALTER TABLE "bangumi" ADD COLUMN "generation" INTEGER NOT NULL DEFAULT 0')
+
+
+@migration
+def add_download_unique_key(database: peewee.SqliteDatabase) -> None:
+    """remove duplicated downloads and add unique key (name, episode, download)"""
+    # keep the most progressed row of duplicated ones
+    database.execute_sql(
+        'DELETE FROM "download" WHERE "id" NOT IN ('
+        'SELECT "id" FROM (SELECT "id", ROW_NUMBER() OVER ('
+        'PARTITION BY "name", "episode", "download" ORDER BY "status" DESC, "id") AS "n" FROM "download"'
+        ') WHERE "n" = 1)'
+    )
+    database.execute_sql('DROP INDEX IF EXISTS "download_name_episode"')
+    database.execute_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS "download_name_episode_download" '
+        'ON "download" ("name", "episode", "download")'
+    )
+
+
+@migration
+def add_download_task_columns(database: peewee.SqliteDatabase) -> None:
+    """add task id and retry state to download"""
+    columns = [x.name for x in database.get_columns("download")]
+    for name, definition in (
+        ("task_id", "TEXT"),
+        ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ("next_attempt_time", "INTEGER NOT NULL DEFAULT 0"),
+    ):
+        if name not in columns:
+            database.execute_sql(f'ALTER TABLE "download" ADD COLUMN "{name}" {definition}')
+
+
+@migration
+def add_download_queue_index(database: peewee.SqliteDatabase) -> None:
+    """add index for due downloads in queue"""
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "download_status_next_attempt_time" ON "download" ("status", "next_attempt_time")'
+    )
+
+
+@migration
+def add_infohash(database: peewee.SqliteDatabase) -> None:
+    """add infohash to download and fetched episode, extracted from download link"""
+    for table in ("download", "episode"):
+        if "infohash" not in [x.name for x in database.get_columns(table)]:
+            database.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "infohash" TEXT NOT NULL DEFAULT \'\'')
+
+        rows = []
+        for id_, link in database.execute_sql(f'SELECT "id", "download" FROM "{table}" WHERE "infohash" = \'\''):
+            infohash = extract_infohash(link or "")
+            if infohash:
+                rows.append((infohash, id_))
+        database.cursor().executemany(f'UPDATE "{table}" SET "infohash" = ? WHERE "id" = ?', rows)
+
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "download_infohash" ON "download" ("infohash")')
+
+
+@migration
+def add_data_version(database: peewee.SqliteDatabase) -> None:
+    """add write counters of tables for http caching"""
+    create_data_version_triggers(database)
+
+
+@migration
+def add_episode_bangumi_unique_key(database: peewee.SqliteDatabase) -> None:
+    """make fetched episode unique by (bangumi_name, download) instead of download"""
+    # peewee names indexes of this table after model name
+    database.execute_sql('DROP INDEX IF EXISTS "fetchedepisode_download"')
+    database.execute_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS "fetchedepisode_bangumi_name_download" '
+        'ON "episode" ("bangumi_name", "download")'
+    )
+
+
+def migrate(database: peewee.SqliteDatabase = db) -> int:
+    """apply pending migrations, return current version of database"""
+    version: int = database.pragma("user_version")
+    for target, m in enumerate(MIGRATIONS[version:], version + 1):
+        print_info(f"Migrate database to version {target}: {m.__doc__}")
+        with database.atomic():
+            m(database)
+            database.pragma("user_version", target)
+    return max(version, len(MIGRATIONS))
+
+
 def update_database() -> None:
     if not old_version_file.exists():
         old_version_file.write_text(__version__, encoding="utf8")
@@ -42,5 +170,7 @@ def update_database() -> None:
     if previous < semver.VersionInfo(major=4, minor=5, patch=1):
         exec_sql("ALTER TABLE download ADD COLUMN created_time INT(11);")
 
+    migrate()
+
     # all upgrade done, write current version
     old_version_file.write_text(__version__, encoding="utf8")
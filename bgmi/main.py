@@ -3,6 +3,7 @@ import itertools
 import os
 import platform
 import sys
+import time
 from operator import itemgetter
 from typing import List, Mapping, Optional, Tuple
 
@@ -18,9 +19,21 @@ from bgmi import __version__
 from bgmi.config import BGMI_PATH, CONFIG_FILE_PATH, Config, cfg, write_default_config
 from bgmi.lib import controllers as ctl
 from bgmi.lib.constants import BANGUMI_UPDATE_TIME, SPACIAL_APPEND_CHARS, SPACIAL_REMOVE_CHARS, SUPPORT_WEBSITE
-from bgmi.lib.download import download_prepare
+from bgmi.lib.download import download_prepare, process_download_queue, reconcile_downloads
 from bgmi.lib.fetch import website
-from bgmi.lib.models import STATUS_DELETED, STATUS_FOLLOWED, STATUS_UPDATED, Bangumi, Filter, Followed, Subtitle
+from bgmi.lib.media import media_index
+from bgmi.lib.models import (
+    STATUS_DELETED,
+    STATUS_FOLLOWED,
+    STATUS_UPDATED,
+    Bangumi,
+    FetchedEpisode,
+    Filter,
+    Followed,
+    Subtitle,
+    get_database_stats,
+    optimize_database,
+)
 from bgmi.lib.update import update_database
 from bgmi.script import ScriptRunner
 from bgmi.setup import create_dir, init_db, install_crontab
@@ -296,7 +309,7 @@ def filter_cmd(
 def print_filter(followed_filter_obj: Filter) -> None:
     print(
         "Followed subtitle group: {}".format(
-            ", ".join(x["name"] for x in Subtitle.get_subtitle_by_id(followed_filter_obj.subtitle.split(", ")))
+            ", ".join(Subtitle.get_subtitle_map(followed_filter_obj.subtitle_group_split).values())
             if followed_filter_obj.subtitle
             else "None"
         )
@@ -415,7 +428,8 @@ def calendar(force_update: bool, today: bool, download_cover: bool) -> None:
 @click.option(
     "--not-ignore", "not_ignore", is_flag=True, help="Do not ignore the old bangumi detail rows (3 month ago)"
 )
-def fetch(name: str, not_ignore: bool) -> None:
+@click.option("--local", is_flag=True, help="Show episodes fetched before, without requesting data source")
+def fetch(name: str, not_ignore: bool, local: bool) -> None:
     """
     name: bangumi name to fetch
     """
@@ -435,11 +449,17 @@ def fetch(name: str, not_ignore: bool) -> None:
     followed_filter_obj = Filter.get(bangumi_name=name)
     print_filter(followed_filter_obj)
 
-    print_info(f"Fetch bangumi {bangumi_obj.name} ...")
-    _, data = website.get_maximum_episode(bangumi_obj, ignore_old_row=not bool(not_ignore))
+    if local:
+        _, data = FetchedEpisode.get_maximum_episode(
+            bangumi_obj.name, followed_filter_obj, ignore_old_row=not bool(not_ignore)
+        )
+    else:
+        print_info(f"Fetch bangumi {bangumi_obj.name} ...")
+        _, data = website.get_maximum_episode(bangumi_obj, ignore_old_row=not bool(not_ignore))
 
     if not data:
         print_warning("Nothing.")
+        return
 
     max_episode = max(i.episode for i in data)
     digest = len(str(max_episode))
@@ -467,6 +487,58 @@ def update(names: List[str], download: bool, not_ignore: bool) -> None:
     ctl.update(names, download=download, not_ignore=not_ignore)
 
 
+@cli.command("reconcile", help="Sync status of downloading tasks from download delegate.")
+@click.option(
+    "--interval",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Keep running and sync every INTERVAL seconds, 0 to sync only once.",
+)
+def reconcile(interval: int) -> None:
+    while True:
+        stats = reconcile_downloads()
+        print_info(
+            "{downloaded} downloaded, {retry} to retry, {error} failed, {downloading} downloading, "
+            "{missing} missing in download delegate".format(**stats)
+        )
+        if not interval:
+            return
+        time.sleep(interval)
+
+
+@cli.command("worker", help="Send queued and failed downloads to download delegate, independent of `bgmi update`.")
+@click.option(
+    "--interval",
+    type=click.IntRange(min=0),
+    default=60,
+    show_default=True,
+    help="Seconds between checking download queue, 0 to check only once.",
+)
+def worker(interval: int) -> None:
+    while True:
+        reconcile_downloads()
+        queue = process_download_queue()
+        if queue:
+            print_info(f"{len(queue)} downloads sent to download delegate")
+        if not interval:
+            return
+        time.sleep(interval)
+
+
+@cli.command("rescan", help="Rebuild index of video files used by web ui player.")
+def rescan() -> None:
+    names = {x.bangumi_name for x in Followed.select(Followed.bangumi_name)}
+    names.update(x["bangumi_name"] for x in ScriptRunner().get_models_dict())
+
+    start = time.perf_counter()
+    stats = media_index.rescan(sorted(names))
+    print_success(
+        "{bangumi} bangumi, {episodes} episodes and {files} video files indexed".format(**stats)
+        + f" in {time.perf_counter() - start:.2f}s"
+    )
+
+
 @cli.command("gen")
 @click.argument("tpl", type=click.Choice(["nginx.conf"]))
 @click.option("--server-name", "server_name")
@@ -551,6 +623,20 @@ def debug_info() -> None:
     print(f"arch: `{platform.architecture()}`")
 
 
+@debug.command("db")
+def debug_db() -> None:
+    """show database stats, then optimize database and checkpoint WAL"""
+    print(f"database: `{cfg.db_path}`")
+    for key, value in get_database_stats().items():
+        print(f"{key}: `{value}`")
+
+    busy, wal_pages, checkpointed = optimize_database()
+    if busy:
+        print_warning("database is being used by other process, WAL is not fully checkpointed")
+    print_success(f"optimized, {checkpointed}/{wal_pages} WAL pages checkpointed")
+    print(f"wal_size: `{get_database_stats()['wal_size']}`")
+
+
 @cli.command("completion")
 @click.argument("shell", required=True)
 def completion(shell: str) -> None:
@@ -1,5 +1,6 @@
 import abc
 from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 
 class DownloadStatus(Enum):
@@ -10,6 +11,18 @@ class DownloadStatus(Enum):
     not_found = 4
 
 
+class AddDownloadResult(NamedTuple):
+    task_id: Optional[str] = None
+    error: Optional[Exception] = None
+
+
+class TaskStatus(NamedTuple):
+    status: DownloadStatus
+    # id of new task which continues this one, for example,
+    # aria2 downloads content of magnet link in a new task after metadata is fetched
+    followed_by: Optional[str] = None
+
+
 class BaseDownloadService(metaclass=abc.ABCMeta):
     """Wrapped RPC client."""
 
@@ -22,6 +35,20 @@ class BaseDownloadService(metaclass=abc.ABCMeta):
         :return: task id
         """
 
+    def add_downloads(self, batch: List[Tuple[str, str]]) -> List[AddDownloadResult]:
+        """download many episodes, client may override it to add them with less requests.
+
+        :param batch: list of ``(url, save_path)``, same as arguments of ``add_download``
+        :return: task id or error of each item, in the same order as ``batch``
+        """
+        result = []
+        for url, save_path in batch:
+            try:
+                result.append(AddDownloadResult(task_id=self.add_download(url=url, save_path=save_path)))
+            except Exception as e:
+                result.append(AddDownloadResult(error=e))
+        return result
+
     @staticmethod
     @abc.abstractmethod
     def check_config() -> None:
@@ -31,6 +58,34 @@ class BaseDownloadService(metaclass=abc.ABCMeta):
     def get_status(self, id: str) -> DownloadStatus:
         """status of downloading task"""
 
+    def get_statuses(self, ids: List[str]) -> Dict[str, DownloadStatus]:
+        """status of many downloading tasks, client may override it to query them in one request.
+
+        :return: status of each task id, task failed to query is missing in result
+        """
+        result = {}
+        for id in ids:
+            try:
+                result[id] = self.get_status(id)
+            except Exception:
+                continue
+        return result
+
+    def get_task_statuses(self, ids: List[str]) -> Dict[str, TaskStatus]:
+        """status of many downloading tasks with id of task following it,
+        client which starts new task for a download should override it.
+
+        :return: same as ``get_statuses``
+        """
+        return {id: TaskStatus(status) for id, status in self.get_statuses(ids).items()}
+
+    def health_check(self) -> bool:
+        """check if connection of this client is still usable, it should be a cheap request.
+
+        Clients are reused across downloads, a client failed health check will be re-created.
+        """
+        return True
+
 
 class MissingDependencyError(Exception):
     def __init__(self, message: str) -> None:
@@ -1,19 +1,37 @@
+import asyncio
 import atexit
+import functools
 import pathlib
 import pickle
+import threading
+import urllib.parse
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Dict, List, Optional, TypeVar
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
 
 from bgmi.config import cfg
 
+T = TypeVar("T")
+
 session = requests.Session()
 
 if cfg.proxy:
     session.proxies = {"http": cfg.proxy, "https": cfg.proxy}
 
+
+def _adapter(**kwargs: Any) -> HTTPAdapter:
+    # urllib3 keeps one connection pool per host, blocking when it's exhausted,
+    # so concurrent fetching never opens more than `max_connections_per_host` connections to a site.
+    return HTTPAdapter(pool_connections=10, pool_maxsize=cfg.max_connections_per_host, pool_block=True, **kwargs)
+
+
 retries = Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-session.mount("https://mikanani.me/", HTTPAdapter(max_retries=retries))
+session.mount("http://", _adapter())
+session.mount("https://", _adapter())
+session.mount("https://mikanani.me/", _adapter(max_retries=retries))
 
 cookies_file = pathlib.Path(cfg.tmp_path).joinpath("mikan_cookies.txt")
 
@@ -31,3 +49,80 @@ if cookies_file.exists():
 def save_cookies() -> None:
     if cookies_file.parent.exists() and cookies_file.parent.is_dir():
         cookies_file.write_bytes(pickle.dumps(session.cookies))
+
+
+# asyncio layer on top of `session`.
+#
+# requests are sent with the shared session in a thread pool, so cookies, proxy,
+# retries and keep-alive connections are shared with the sync callers.
+# Coroutines can be awaited in any event loop, sync code should use `run_sync`.
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="bgmi-http")
+
+_host_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    semaphores = _host_semaphores.setdefault(asyncio.get_running_loop(), {})
+    host = urllib.parse.urlsplit(url).netloc
+    if host not in semaphores:
+        semaphores[host] = asyncio.Semaphore(cfg.max_connections_per_host)
+    return semaphores[host]
+
+
+async def async_request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    """send a request without blocking event loop,
+    at most ``cfg.max_connections_per_host`` requests to the same host are in flight.
+
+    keyword arguments are passed to ``requests.Session.request``,
+    ``timeout`` default to ``cfg.request_timeout``.
+    """
+    kwargs.setdefault("timeout", cfg.request_timeout)
+    async with _host_semaphore(url):
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, functools.partial(session.request, method, url, **kwargs)
+        )
+
+
+async def async_get(url: str, **kwargs: Any) -> requests.Response:
+    return await async_request("GET", url, **kwargs)
+
+
+async def async_post(url: str, **kwargs: Any) -> requests.Response:
+    return await async_request("POST", url, **kwargs)
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop  # pylint: disable=global-statement
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="bgmi-http-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(aw: Awaitable[T]) -> T:
+    """sync facade of the asyncio layer, block current thread until ``aw`` is done.
+
+    The awaitable is executed in a background event loop,
+    so it works from worker threads and from a thread already running an event loop (tornado).
+    """
+
+    async def wrapper() -> T:
+        return await aw
+
+    return asyncio.run_coroutine_threadsafe(wrapper(), _background_loop()).result()
+
+
+def gather_sync(*aws: Awaitable[T]) -> List[T]:
+    """run awaitables concurrently and return their results in order, the first exception will be raised."""
+
+    async def wrapper() -> List[T]:
+        return list(await asyncio.gather(*aws))
+
+    return run_sync(wrapper())
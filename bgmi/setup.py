@@ -3,10 +3,13 @@ from pathlib import Path
 from shutil import copy
 from typing import List, Type
 
+import peewee
+
 from bgmi import __version__
 from bgmi.config import BGMI_PATH, IS_WINDOWS, cfg
 from bgmi.lib import models
 from bgmi.lib.models import NeoDB
+from bgmi.lib.update import MIGRATIONS
 from bgmi.utils import print_error, print_info, print_success, print_warning
 
 
@@ -52,7 +55,13 @@ def create_dir() -> None:
         print_error(f"Error: {str(e)}")
 
 
-def init_db() -> None:
+def init_db(database: peewee.SqliteDatabase = models.db) -> None:
+    """
+    create tables of a fresh install, and mark database as migrated to the latest version.
+
+    Only missing tables are created in an existing database, tables of old version are
+    upgraded by ``update_database``, indexes of ``Meta`` may cover columns they don't have yet.
+    """
     tables: List[Type[NeoDB]] = [
         models.Scripts,
         models.Bangumi,
@@ -60,7 +69,15 @@ def init_db() -> None:
         models.Subtitle,
         models.Filter,
         models.Download,
+        models.FetchedEpisode,
     ]
 
-    for t in tables:
-        t.create_table()
+    with database.bind_ctx(tables), database.atomic():
+        fresh = not database.get_tables()
+        for t in tables:
+            if fresh or not t.table_exists():
+                t.create_table()
+        if fresh:
+            database.pragma("user_version", len(MIGRATIONS))
+
+    models.create_data_version_triggers(database)
@@ -8,6 +8,7 @@ import struct
 import subprocess
 import sys
 import tarfile
+import tempfile
 import time
 import traceback
 from io import BytesIO
@@ -328,6 +329,19 @@ def convert_cover_url_to_path(cover_url: str) -> Tuple[str, str]:
     return dir_path, file_path
 
 
+def write_file_atomic(path: Path, content: bytes) -> None:
+    """write to a temp file then rename it, concurrent readers never see partial content."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
 def download_file(url: str) -> Optional[Response]:
     logger.debug("downloading {}", url)
     if url.startswith("https://") or url.startswith("http://"):
@@ -1,13 +1,14 @@
 import datetime
 import os
 import time
-from typing import Any, Dict, List, Optional, Tuple, TypedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
 
 import requests
 
 from bgmi.config import cfg
+from bgmi.http_cache import cached_request
 from bgmi.lib.constants import BANGUMI_UPDATE_TIME
-from bgmi.session import session
+from bgmi.session import async_request, gather_sync, session
 from bgmi.utils import bug_report, print_error, print_info, print_warning
 from bgmi.website.base import BaseWebsite
 from bgmi.website.model import Episode, SubtitleGroup, WebsiteBangumi
@@ -27,12 +28,23 @@ SEARCH_TAG_URL = f"{BANGUMI_MOE_URL}{__split}api/tag/search"
 TORRENT_URL = f"{BANGUMI_MOE_URL}{__split}download/torrent/"
 COVER_URL = "https://bangumi.moe/"
 
+# seconds to use cached responses without revalidating
+CALENDAR_TTL = 600
+TEAM_TTL = 600
+NAME_TTL = 24 * 3600
 
-def get_response(url, method="GET", **kwargs):
+
+def get_response(url, method="GET", ttl=None, **kwargs):
+    """
+    :param ttl: use response cache with this ttl, ``None`` to disable cache.
+    """
     if os.environ.get("DEBUG"):  # pragma: no cover
         print_info(f"Request URL: {url}")
     try:
-        r = session.request(method.lower(), url, timeout=60, **kwargs)
+        if ttl is None:
+            r = session.request(method.lower(), url, timeout=60, **kwargs)
+        else:
+            r = cached_request(method, url, ttl=ttl, timeout=60, **kwargs)
         if os.environ.get("DEBUG"):  # pragma: no cover
             print(r.text)
         r.raise_for_status()
@@ -47,6 +59,60 @@ def get_response(url, method="GET", **kwargs):
     raise ValueError
 
 
+async def _get_response_async(url, method="GET", **kwargs):
+    if os.environ.get("DEBUG"):  # pragma: no cover
+        print_info(f"Request URL: {url}")
+    r = await async_request(method, url, timeout=60, **kwargs)
+    if os.environ.get("DEBUG"):  # pragma: no cover
+        print(r.text)
+    r.raise_for_status()
+    return r.json()
+
+
+def get_responses(requests_kwargs: List[Dict[str, Any]]) -> List[Any]:
+    """
+    concurrent version of ``get_response``, results are in the same order as ``requests_kwargs``.
+
+    :param requests_kwargs: list of keyword arguments of ``get_response``
+    """
+    try:
+        return gather_sync(*[_get_response_async(**kwargs) for kwargs in requests_kwargs])
+    except requests.ConnectionError:
+        print_error("error: failed to establish a new connection")
+    except ValueError:
+        print_error(
+            "error: server returned data maybe not be json,"
+            " please create a issue at https://github.com/BGmi/BGmi/issues"
+        )
+    raise ValueError
+
+
+def publish_time(torrent: Dict[str, Any]) -> int:
+    return int(datetime.datetime.strptime(torrent["publish_time"].split(".")[0], "%Y-%m-%dT%H:%M:%S").timestamp())
+
+
+def fetch_pages(url: str, payload: Callable[[int], Dict[str, Any]], count: int, since: int = 0) -> List[Any]:
+    """
+    fetch ``count`` pages of a paginated torrent api.
+
+    First page is fetched alone to get ``page_count``,
+    then the rest pages are fetched concurrently without exceeding ``page_count``.
+
+    :param payload: build json body from page number, starts from 1
+    :param since: don't fetch the rest pages if first page already has torrents published before it
+    """
+    first = get_response(url, "POST", json=payload(1))
+    if count <= 1 or not isinstance(first, dict) or "torrents" not in first:
+        return [first]
+
+    if since and any(publish_time(x) <= since for x in first["torrents"]):
+        return [first]
+
+    last_page = min(count, first.get("page_count") or count)
+    rest = get_responses([{"url": url, "method": "POST", "json": payload(p)} for p in range(2, last_page + 1)])
+    return [first, *rest]
+
+
 _AVAILABLE_LANG = ("zh_cn", "zh_tw", "en", "ja")
 
 
@@ -77,8 +143,8 @@ class BangumiData(TypedDict):
 def parser_bangumi(data: List[BangumiData]):
     """match weekly bangumi list from data"""
     ids = [b["tag_id"] for b in data]
-    subtitle = get_response(TEAM_URL, "POST", json={"tag_ids": ids})
-    name = process_name(get_response(NAME_URL, "POST", json={"_ids": ids}))
+    subtitle = get_response(TEAM_URL, "POST", ttl=TEAM_TTL, json={"tag_ids": ids})
+    name = process_name(get_response(NAME_URL, "POST", ttl=NAME_TTL, json={"_ids": ids}))
 
     weekly_list = []
     bangumi_update_time_known = BANGUMI_UPDATE_TIME[:-1]
@@ -109,23 +175,25 @@ class BangumiMoe(BaseWebsite):
         bangumi_id: str,
         max_page: int,
         subtitle_list: Optional[List[str]] = None,
+        since: int = 0,
     ) -> List[Episode]:
         response_data = []
         ret = []
         if subtitle_list:
-            for subtitle_id in subtitle_list:
-                data: Dict[str, Any] = {"tag_id": [bangumi_id, subtitle_id, BANGUMI_TAG]}
-                response = get_response(DETAIL_URL, "POST", json=data)
+            responses = get_responses(
+                [
+                    {"url": DETAIL_URL, "method": "POST", "json": {"tag_id": [bangumi_id, subtitle_id, BANGUMI_TAG]}}
+                    for subtitle_id in subtitle_list
+                ]
+            )
+            for response in responses:
                 response_data.extend(response["torrents"])
         else:
-            for i in range(max_page):
-                if max_page > 1:
-                    print_info(f"Fetch page {i + 1} ...")
-                data = {
-                    "tag_id": [bangumi_id, BANGUMI_TAG],
-                    "p": i + 1,
-                }
-                response = get_response(DETAIL_URL, "POST", json=data)
+            if max_page > 1:
+                print_info(f"Fetch {max_page} pages ...")
+            for response in fetch_pages(
+                DETAIL_URL, lambda page: {"tag_id": [bangumi_id, BANGUMI_TAG], "p": page}, max_page, since=since
+            ):
                 if response:
                     response_data.extend(response["torrents"])
         for index, bangumi in enumerate(response_data):
@@ -135,11 +203,8 @@ class BangumiMoe(BaseWebsite):
                     subtitle_group=bangumi["team_id"],
                     title=bangumi["title"],
                     episode=self.parse_episode(bangumi["title"]),
-                    time=int(
-                        datetime.datetime.strptime(
-                            bangumi["publish_time"].split(".")[0], "%Y-%m-%dT%H:%M:%S"
-                        ).timestamp()
-                    ),
+                    time=publish_time(bangumi),
+                    infohash=bangumi.get("infoHash", ""),
                 )
             )
 
@@ -149,7 +214,7 @@ class BangumiMoe(BaseWebsite):
         return ret
 
     def fetch_bangumi_calendar(self) -> List[WebsiteBangumi]:
-        response = get_response(FETCH_URL)
+        response = get_response(FETCH_URL, ttl=CALENDAR_TTL)
         if not response:
             return []
         bangumi_result = parser_bangumi(response)
@@ -161,6 +226,7 @@ class BangumiMoe(BaseWebsite):
             result.append(
                 Episode(
                     download=TORRENT_URL + info["_id"] + "/download.torrent",
+                    infohash=info.get("infoHash", ""),
                     name=keyword,
                     subtitle_group=info["team_id"],
                     title=info["title"],
@@ -213,18 +279,12 @@ class BangumiMoe(BaseWebsite):
 
         rows = []
 
-        for i in range(count):
-            data = get_response(DETAIL_URL, "POST", json={"tag_id": tag_id, "p": i + 1})
+        for data in fetch_pages(DETAIL_URL, lambda page: {"tag_id": tag_id, "p": page}, count):
             if "torrents" not in data:
                 print_warning("No torrents in response data, please re-run")
                 return []
             rows.extend(data["torrents"])
 
-            if "page_count" in data:
-                page_count = data["page_count"]
-                if page_count - 1 == i:
-                    break
-
         result = self.process_search_result(anime_name, rows)
         return result
 
@@ -234,8 +294,7 @@ class BangumiMoe(BaseWebsite):
 
         rows = []
 
-        for i in range(count):
-            data = get_response(SEARCH_URL, "POST", json={"query": keyword, "p": i + 1})
+        for data in fetch_pages(SEARCH_URL, lambda page: {"query": keyword, "p": page}, count):
             if "torrents" not in data:
                 print_warning("No torrents in response data, please re-run")
                 return []
@@ -1,11 +1,21 @@
-import time
 from collections import defaultdict
 from itertools import chain
-from typing import Any, Dict, List, Optional, Tuple, TypeVar
+from typing import Any, Dict, List, Optional, Set, Tuple, TypeVar
+
+from peewee import chunked
 
 from bgmi.config import cfg
-from bgmi.lib.models import STATUS_FOLLOWED, STATUS_UPDATED, STATUS_UPDATING, Bangumi, Filter, Subtitle
-from bgmi.utils import parse_episode
+from bgmi.lib.models import (
+    STATUS_FOLLOWED,
+    STATUS_UPDATED,
+    STATUS_UPDATING,
+    Bangumi,
+    FetchedEpisode,
+    Filter,
+    Subtitle,
+    db,
+)
+from bgmi.utils import parse_episode, print_info
 from bgmi.website.model import Episode, WebsiteBangumi
 
 T = TypeVar("T", bound=dict)
@@ -17,46 +27,96 @@ class BaseWebsite:
     @staticmethod
     def save_bangumi(data: WebsiteBangumi) -> None:
         """save bangumi to database"""
-        b, obj_created = Bangumi.get_or_create(keyword=data.keyword, defaults=data.model_dump())
-        if not obj_created:
-            should_save = False
-            if data.cover and b.cover != data.cover:
-                b.cover = data.cover
-                should_save = True
-
-            if data.update_time not in ("Unknown", b.update_time):
-                b.update_time = data.update_time
-                should_save = True
-
-            subtitle_group = Bangumi(subtitle_group=data.subtitle_group).subtitle_group
-
-            if b.status != STATUS_UPDATING or b.subtitle_group != subtitle_group:
-                b.status = STATUS_UPDATING
-                if data.subtitle_group:
-                    b.subtitle_group = subtitle_group
-                should_save = True
-
-            if should_save:
-                b.save()
-
-        for subtitle_group in data.subtitle_group:
-            (
-                Subtitle.insert(
-                    {
-                        Subtitle.id: str(subtitle_group.id),
-                        Subtitle.name: str(subtitle_group.name),
-                    }
-                ).on_conflict_replace()
-            ).execute()
+        BaseWebsite.save_bangumi_list([data])
+
+    @staticmethod
+    def _merge_bangumi(b: Bangumi, data: WebsiteBangumi) -> bool:
+        """apply website data on stored bangumi, return ``True`` if it's changed"""
+        changed = False
+        if data.cover and b.cover != data.cover:
+            b.cover = data.cover
+            changed = True
+
+        if data.update_time not in ("Unknown", b.update_time):
+            b.update_time = data.update_time
+            changed = True
+
+        subtitle_group = Bangumi(subtitle_group=data.subtitle_group).subtitle_group
+
+        if b.status != STATUS_UPDATING or b.subtitle_group != subtitle_group:
+            b.status = STATUS_UPDATING
+            if data.subtitle_group:
+                b.subtitle_group = subtitle_group
+            changed = True
+
+        return changed
+
+    @staticmethod
+    def save_bangumi_list(bangumi_list: List[WebsiteBangumi], generation: Optional[int] = None) -> Dict[str, int]:
+        """
+        save bangumi and their subtitle groups to database in one transaction,
+        only new and changed rows are written.
+
+        :param generation: generation of calendar refresh, it's saved on all bangumi in ``bangumi_list``
+        :return: count of inserted, updated and unchanged bangumi
+        """
+        with db.atomic():
+            stored: Dict[str, Bangumi] = {}
+            for batch in chunked({x.keyword for x in bangumi_list}, 500):
+                for b in Bangumi.select().where(Bangumi.keyword.in_(batch)):
+                    stored.setdefault(b.keyword, b)
+
+            new_rows: Dict[str, Dict[str, Any]] = {}
+            changed: Dict[str, Bangumi] = {}
+            unchanged: Set[str] = set()
+            for data in bangumi_list:
+                b = stored.get(data.keyword)
+                if b is None:
+                    new_rows.setdefault(data.keyword, Bangumi(**data.model_dump()).__data__)
+                elif BaseWebsite._merge_bangumi(b, data):
+                    changed[data.keyword] = b
+                else:
+                    unchanged.add(data.keyword)
+
+            if generation is not None:
+                for row in new_rows.values():
+                    row["generation"] = generation
+
+            for rows in chunked(new_rows.values(), 100):
+                Bangumi.insert_many(rows).on_conflict_ignore().execute()
+            if changed:
+                Bangumi.bulk_update(
+                    list(changed.values()),
+                    fields=[Bangumi.cover, Bangumi.update_time, Bangumi.status, Bangumi.subtitle_group],
+                    batch_size=100,
+                )
+            if generation is not None:
+                # stamped with one statement per chunk, rows are not rewritten
+                for keywords in chunked(changed.keys() | unchanged, 500):
+                    Bangumi.update(generation=generation).where(Bangumi.keyword.in_(keywords)).execute()
+
+            subtitle_groups = {str(x.id): str(x.name) for data in bangumi_list for x in data.subtitle_group}
+            stored_subtitle = Subtitle.get_subtitle_map(subtitle_groups)
+            subtitle_rows = [
+                {"id": id_, "name": name} for id_, name in subtitle_groups.items() if stored_subtitle.get(id_) != name
+            ]
+            for rows in chunked(subtitle_rows, 100):
+                Subtitle.insert_many(rows).on_conflict_replace().execute()
+
+        return {"inserted": len(new_rows), "updated": len(changed), "unchanged": len(unchanged - changed.keys())}
 
     def fetch(self, group_by_weekday: bool = True) -> Any:
         bangumi_result = self.fetch_bangumi_calendar()
         if not bangumi_result:
             print("can't fetch anything from website")
             return []
-        Bangumi.delete_all()
-        for bangumi in bangumi_result:
-            self.save_bangumi(bangumi)
+
+        with db.atomic():
+            generation = Bangumi.next_generation()
+            stats = self.save_bangumi_list(bangumi_result, generation=generation)
+            # bangumi not in calendar any more
+            Bangumi.delete_all(generation=generation)
+        print_info("{inserted} bangumi added, {updated} updated, {unchanged} unchanged".format(**stats))
 
         if group_by_weekday:
             result_group_by_weekday = defaultdict(list)
@@ -76,11 +136,18 @@ class BaseWebsite:
         weekly_list = defaultdict(list)
         for k, v in chain(weekly_list_followed.items(), weekly_list_updated.items()):
             weekly_list[k].extend(v)
+        subtitle_map = Subtitle.get_subtitle_map(
+            x
+            for bangumi_list in weekly_list.values()
+            for bangumi in bangumi_list
+            for x in bangumi["subtitle_group"].split(", ")
+        )
         for bangumi_list in weekly_list.values():
             for bangumi in bangumi_list:
                 bangumi["subtitle_group"] = [
-                    {"name": x["name"], "id": x["id"]}
-                    for x in Subtitle.get_subtitle_by_id(bangumi["subtitle_group"].split(", "))
+                    {"name": subtitle_map[x], "id": x}
+                    for x in bangumi["subtitle_group"].split(", ")
+                    if x in subtitle_map
                 ]
         return weekly_list
 
@@ -92,33 +159,48 @@ class BaseWebsite:
     ) -> Tuple[int, List[Episode]]:
         followed_filter_obj, _ = Filter.get_or_create(bangumi_name=bangumi.name)
 
+        info, data = self.fetch_bangumi_episodes(
+            bangumi, subtitle_list=followed_filter_obj.subtitle_group_split, max_page=max_page
+        )
+        if info is not None:
+            self.save_bangumi(info)
+        FetchedEpisode.save_episodes(data)
+
+        return FetchedEpisode.get_maximum_episode(bangumi.name, followed_filter_obj, ignore_old_row=ignore_old_row)
+
+    def fetch_bangumi_episodes(
+        self,
+        bangumi: Bangumi,
+        subtitle_list: Optional[List[str]] = None,
+        max_page: int = cfg.max_path,
+        since: int = 0,
+    ) -> Tuple[Optional[WebsiteBangumi], List[Episode]]:
+        """
+        network part of ``get_maximum_episode``, it doesn't write to database,
+        so it's safe to call it from worker threads.
+
+        :param since: timestamp of latest stored episode, see ``fetch_episode_of_bangumi``
+        :return: bangumi info to be saved (if website provide it) and unfiltered episodes
+        """
         info = self.fetch_single_bangumi(
             bangumi.keyword,
-            subtitle_list=followed_filter_obj.subtitle_group_split,
+            subtitle_list=subtitle_list,
             max_page=max_page,
         )
         if info is not None:
-            self.save_bangumi(info)
-            data = followed_filter_obj.apply_on_episodes(info.episodes)
+            data = info.episodes
         else:
             data = self.fetch_episode_of_bangumi(
                 bangumi_id=bangumi.keyword,
                 max_page=max_page,
-                subtitle_list=followed_filter_obj.subtitle_group_split,
+                subtitle_list=subtitle_list,
+                since=since,
             )
-            data = followed_filter_obj.apply_on_episodes(data)
 
         for episode in data:
             episode.name = bangumi.name
 
-        if ignore_old_row:
-            data = [row for row in data if row.time > int(time.time()) - 3600 * 24 * 30 * 3]  # three month
-
-        if data:
-            b = max(data, key=lambda _i: _i.episode)
-            return b.episode, data
-        else:
-            return 0, []
+        return info, data
 
     def fetch_episode(
         self,
@@ -173,7 +255,7 @@ class BaseWebsite:
         raise NotImplementedError
 
     def fetch_episode_of_bangumi(
-        self, bangumi_id: str, max_page: int, subtitle_list: Optional[List[str]] = None
+        self, bangumi_id: str, max_page: int, subtitle_list: Optional[List[str]] = None, since: int = 0
     ) -> List[Episode]:  # pragma: no cover
         """
         get all episode by bangumi id
@@ -181,6 +263,9 @@ class BaseWebsite:
         :param bangumi_id: bangumi_id
         :param subtitle_list: list of subtitle group
         :param max_page: how many page to crawl
+        :param since: only items published after it are needed,
+            website may stop crawling more pages when it reaches older items,
+            but older items can still be returned.
         :return: list of bangumi
         """
         raise NotImplementedError
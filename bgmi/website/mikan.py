@@ -1,26 +1,33 @@
 import datetime
 import os
 import time
-from collections import defaultdict
-from typing import List, Optional
+from typing import Dict, List, Optional
 from xml.etree import ElementTree
 
 import bs4
 import yarl
 from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
 from strsimpy.normalized_levenshtein import NormalizedLevenshtein
 
 from bgmi.config import cfg
+from bgmi.http_cache import cached_request
+from bgmi.session import async_get, gather_sync
 from bgmi.session import session as requests
 from bgmi.utils import parse_episode, print_info
 from bgmi.website.base import BaseWebsite
 from bgmi.website.model import Episode, SubtitleGroup, WebsiteBangumi
+from bgmi.website.parse_cache import dump_episodes, load_episodes, parse_cache
 
 server_root = f"{cfg.mikan_url.encoded_string().rstrip('/')}/"
 login_url = f"{server_root}Account/Login"
 
 _COVER_URL = server_root[:-1]
 
+# seconds to use cached pages without revalidating
+CALENDAR_TTL = 600
+BANGUMI_PAGE_TTL = 0
+
 # Example: /Home/ExpandEpisodeTable?bangumiId=2242&subtitleGroupId=34&take=65
 bangumi_episode_expand_api = f"{server_root}Home/ExpandEpisodeTable"
 
@@ -47,12 +54,20 @@ _DAY_OF_WEEK = {
 }
 
 
+# lxml is much faster than html.parser on large bangumi pages, use it if it's installed
+TREE_BUILDER = "lxml" if builder_registry.lookup("lxml") else "html.parser"
+
+
+def make_soup(content: str) -> BeautifulSoup:
+    return BeautifulSoup(content, TREE_BUILDER)
+
+
 def get_weekly_bangumi():
     """
     network
     """
-    r = get_text(server_root)
-    soup = bs4.BeautifulSoup(r, "html.parser")
+    r = get_text(server_root, ttl=CALENDAR_TTL)
+    soup = make_soup(r)
     for day_of_week in [x for x in range(0, 9) if x != 7]:
         d = soup.find("div", attrs={"class": "sk-bangumi", "data-dayofweek": str(day_of_week)})
         if d:
@@ -62,9 +77,42 @@ def get_weekly_bangumi():
                 pass
 
 
-def parse_episodes(content, bangumi_id, subtitle_list=None) -> List[Episode]:
+def parse_episodes(content, bangumi_id, subtitle_list=None, soup: Optional[BeautifulSoup] = None) -> List[Episode]:
+    """
+    parse episodes of bangumi page, result is reused if page content is unchanged.
+
+    :param soup: parsed ``content``, pass it if caller has already parsed the page.
+    """
+    cache_name = "mikan-episodes-{}-{}".format(bangumi_id, ",".join(sorted(subtitle_list or [])))
+    cached = parse_cache.get(cache_name, content)
+    if cached is not None:
+        return load_episodes(cached)
+
+    result = _parse_episodes(soup or make_soup(content), bangumi_id, subtitle_list)
+    parse_cache.set(cache_name, content, dump_episodes(result))
+    return result
+
+
+def fetch_expand_tables(bangumi_id, subtitle_ids: List[str]) -> Dict[str, str]:
+    """fetch full episode tables of subtitle groups concurrently, return html of tables by subtitle group id"""
+    responses = gather_sync(
+        *[
+            async_get(
+                bangumi_episode_expand_api,
+                params={
+                    "bangumiId": bangumi_id,
+                    "subtitleGroupId": subtitle_id,
+                    "take": 200,
+                },
+            )
+            for subtitle_id in subtitle_ids
+        ]
+    )
+    return {subtitle_id: r.text for subtitle_id, r in zip(subtitle_ids, responses)}
+
+
+def _parse_episodes(soup: BeautifulSoup, bangumi_id, subtitle_list=None) -> List[Episode]:
     result = []
-    soup = BeautifulSoup(content, "html.parser")
     container = soup.find("div", class_="central-container")
     assert isinstance(container, bs4.Tag), "Central container not found or not a Tag"
 
@@ -86,19 +134,13 @@ def parse_episodes(content, bangumi_id, subtitle_list=None) -> List[Episode]:
             if subtitle_id:
                 episode_container_list[tag.attrs.get("id", None)] = tag.find_next_sibling("div", class_="episode-table")
 
+    # only fetch full tables of groups we are going to parse
+    expand_tables = fetch_expand_tables(bangumi_id, [x for x in episode_container_list if x in expand_subtitle_map])
+
     for subtitle_id, container in episode_container_list.items():
         _container = container
-        if subtitle_id in expand_subtitle_map:
-            expand_r = requests.get(
-                bangumi_episode_expand_api,
-                params={
-                    "bangumiId": bangumi_id,
-                    "subtitleGroupId": subtitle_id,
-                    "take": 200,
-                },
-            ).text
-            expand_soup = BeautifulSoup(expand_r, "html.parser")
-            _container = expand_soup.find("table")
+        if subtitle_id in expand_tables:
+            _container = make_soup(expand_tables[subtitle_id]).find("table")
 
         assert isinstance(_container, bs4.Tag), f"Failed to parse bangumi {bangumi_id} subtitle {subtitle_id}"
 
@@ -153,7 +195,7 @@ def parser_day_bangumi(soup) -> List[WebsiteBangumi]:
 
 def mikan_login():
     r = requests.get(login_url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = make_soup(r.text)
     token = soup.find("input", attrs={"name": "__RequestVerificationToken"})["value"]
 
     if os.environ.get("DEBUG", False):  # pragma: no cover
@@ -174,15 +216,25 @@ def mikan_login():
         raise ValueError("mikan login failed with wrong username or password")
 
 
-def get_text(url, params=None):
+def get_text(url, params=None, ttl=None):
+    """
+    :param ttl: use response cache with this ttl, ``None`` to disable cache.
+    """
     if os.environ.get("DEBUG", False):  # pragma: no cover
         print(url, params)
 
+    def get():
+        if ttl is None:
+            return requests.get(url, params=params)
+        return cached_request("GET", url, params=params, ttl=ttl)
+
     if not cfg.mikan_username or not cfg.mikan_password:
-        return requests.get(url, params=params).text
+        return get().text
 
+    # always revalidate, page cached before login should not be used as logged in page
+    ttl = None if ttl is None else 0
     for _ in range(2):
-        r = requests.get(url, params=params)
+        r = get()
         if r.headers.get("content-type").startswith("text/html"):
             if "退出" in r.text:
                 return r.text
@@ -196,9 +248,11 @@ def get_text(url, params=None):
 
 class Mikanani(BaseWebsite):
     def parse_bangumi_details_page(self, r):
-        subtitle_groups = defaultdict(dict)
-
-        soup = BeautifulSoup(r, "html.parser")
+        """
+        :param r: page content, or its parsed soup
+        :type r: str | bs4.BeautifulSoup
+        """
+        soup = r if isinstance(r, BeautifulSoup) else make_soup(r)
 
         # info
         bangumi_info = {"status": 0}
@@ -208,33 +262,6 @@ class Mikanani(BaseWebsite):
         bangumi_info["name"] = title.text
         bangumi_info["update_time"] = _CN_WEEK[day.text[-3:]]
 
-        ######
-        soup = BeautifulSoup(r, "html.parser")
-        container = soup.find("div", class_="central-container")
-        episode_container_list = {}
-        for tag in container.contents:
-            if not hasattr(tag, "attrs"):
-                continue
-            subtitle_id = tag.attrs.get("id", False)
-            if subtitle_id:
-                episode_container_list[tag.attrs.get("id")] = tag.find_next_sibling("div", class_="episode-table")
-
-        for subtitle_id, container in episode_container_list.items():
-            subtitle_groups[str(subtitle_id)]["episode"] = []
-            for tr in container.find_all("tr")[1:]:
-                title = tr.find("a", class_="magnet-link-wrap").text
-                time_string = tr.find_all("td")[3].string
-                subtitle_groups[str(subtitle_id)]["episode"].append(
-                    {
-                        "download": tr.find("a", class_="magnet-link").attrs["data-clipboard-text"],
-                        "subtitle_group": str(subtitle_id),
-                        "title": title,
-                        "episode": self.parse_episode(title),
-                        "time": int(time.mktime(time.strptime(time_string, "%Y/%m/%d %H:%M"))),
-                    }
-                )
-
-        ######
         nr = []
         dv = soup.find("div", class_="leftbar-nav")
         li_list = dv.ul.find_all("li")
@@ -251,7 +278,7 @@ class Mikanani(BaseWebsite):
 
     def search_by_tag(self, tag: str, subtitle: Optional[str] = None, count: Optional[int] = None) -> List[Episode]:
         r = get_text(server_root + "Home/Search", params={"searchstr": tag})
-        s = BeautifulSoup(r, "html.parser")
+        s = make_soup(r)
         animate = s.find_all("div", attrs={"class": "an-info-group"})[0]
         assert isinstance(animate, bs4.Tag), "Animate [div.an-info-group] not found or not a Tag"
 
@@ -268,7 +295,7 @@ class Mikanani(BaseWebsite):
         animate_link = animate_link.lstrip("/")
 
         r = get_text(server_root + animate_link)
-        s = BeautifulSoup(r, "html.parser")
+        s = make_soup(r)
 
         lowest_distance = 1.0
         best_sim_match_group = None
@@ -360,7 +387,7 @@ class Mikanani(BaseWebsite):
     def search_by_keyword(self, keyword, count=None):
         result = []
         r = get_text(server_root + "Home/Search", params={"searchstr": keyword})
-        s = BeautifulSoup(r, "html.parser")
+        s = make_soup(r)
         td_list = s.find_all("tr", attrs={"class": "js-search-results-row"})
         for tr in td_list:
             title = tr.find("a", class_="magnet-link-wrap").text
@@ -379,8 +406,9 @@ class Mikanani(BaseWebsite):
             )
         return result
 
-    def fetch_episode_of_bangumi(self, bangumi_id, max_page=cfg.max_path, subtitle_list=None):
-        r = get_text(server_root + f"Home/Bangumi/{bangumi_id}")
+    def fetch_episode_of_bangumi(self, bangumi_id, max_page=cfg.max_path, subtitle_list=None, since=0):
+        # all episodes are in a single page, ``since`` saves nothing
+        r = get_text(server_root + f"Home/Bangumi/{bangumi_id}", ttl=BANGUMI_PAGE_TTL)
         return parse_episodes(r, bangumi_id, subtitle_list)
 
     def fetch_bangumi_calendar(self) -> List[WebsiteBangumi]:
@@ -398,13 +426,26 @@ class Mikanani(BaseWebsite):
         subtitle_list: Optional[List[str]] = None,
         max_page: int = 0,
     ) -> Optional[WebsiteBangumi]:
-        html = get_text(server_root + f"Home/Bangumi/{bangumi_id}")
-        info = self.parse_bangumi_details_page(html)
+        html = get_text(server_root + f"Home/Bangumi/{bangumi_id}", ttl=BANGUMI_PAGE_TTL)
+        # page is parsed at most once, and only if one of parse cache is outdated
+        soup: Optional[BeautifulSoup] = None
+
+        cache_name = f"mikan-details-{bangumi_id}"
+        cached = parse_cache.get(cache_name, html)
+        if cached is not None:
+            info = {**cached, "subtitle_group": [SubtitleGroup(id=i, name=n) for i, n in cached["subtitle_group"]]}
+        else:
+            soup = make_soup(html)
+            info = self.parse_bangumi_details_page(soup)
+            parse_cache.set(
+                cache_name, html, {**info, "subtitle_group": [[x.id, x.name] for x in info["subtitle_group"]]}
+            )
+
         return WebsiteBangumi(
             name=info["name"],
             keyword=bangumi_id,
             status=info["status"],
             update_time=info["update_time"],
             subtitle_group=info["subtitle_group"],
-            episodes=parse_episodes(html, bangumi_id, subtitle_list),
+            episodes=parse_episodes(html, bangumi_id, subtitle_list, soup=soup),
         )
@@ -1,10 +1,41 @@
+import base64
+import binascii
+import re
 from operator import attrgetter
-from typing import List, Optional
+from typing import List, Optional, Set
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, model_validator
 
 from bgmi.lib.constants import BANGUMI_UPDATE_TIME
 
+_MAGNET_BTIH = re.compile(r"xt=urn:btih:([0-9a-zA-Z]+)")
+# mikan and many other sites name torrent file with its infohash
+_TORRENT_FILE = re.compile(r"/([0-9a-fA-F]{40})\.torrent(?:$|[?#])")
+
+
+def extract_infohash(link: str) -> str:
+    """
+    infohash of magnet link or torrent url, as lower case hex string.
+
+    return empty string if infohash is not in link, for example, bangumi.moe torrent url.
+    """
+    m = _MAGNET_BTIH.search(link)
+    if m:
+        value = m.group(1)
+        if len(value) == 40:
+            return value.lower()
+        if len(value) == 32:
+            try:
+                return base64.b32decode(value.upper()).hex()
+            except binascii.Error:
+                return ""
+        return ""
+
+    m = _TORRENT_FILE.search(link)
+    if m:
+        return m.group(1).lower()
+    return ""
+
 
 class Episode(BaseModel):
     title: str
@@ -13,15 +44,23 @@ class Episode(BaseModel):
     time: int = 0
     subtitle_group: Optional[str] = None
     name: str = ""
+    infohash: str = ""
+
+    @model_validator(mode="after")
+    def fill_infohash(self) -> "Episode":
+        if not self.infohash:
+            self.infohash = extract_infohash(self.download)
+        return self
 
     @staticmethod
     def remove_duplicated_bangumi(result: List["Episode"]) -> List["Episode"]:
+        """keep the first episode of each episode number"""
         ret = []
-        episodes = list({i.episode for i in result})
+        seen: Set[int] = set()
         for i in result:
-            if i.episode in episodes:
+            if i.episode not in seen:
+                seen.add(i.episode)
                 ret.append(i)
-                del episodes[episodes.index(i.episode)]
 
         return ret
 
@@ -0,0 +1,60 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, List, Optional
+
+from bgmi.config import cfg
+from bgmi.utils import write_file_atomic
+from bgmi.website.model import Episode
+
+# field order of compact episode rows
+_EPISODE_FIELDS = ("title", "download", "episode", "time", "subtitle_group")
+
+
+def dump_episodes(episodes: List[Episode]) -> List[list]:
+    return [[getattr(e, f) for f in _EPISODE_FIELDS] for e in episodes]
+
+
+def load_episodes(rows: List[list]) -> List[Episode]:
+    return [Episode(**dict(zip(_EPISODE_FIELDS, row))) for row in rows]
+
+
+class ParseCache:
+    """
+    keep the last parsed result of pages.
+
+    Each cache name (for example, a bangumi page) has only one entry,
+    the result is used only when sha1 of page content is unchanged.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _file(self, name: str) -> Path:
+        return self.path.joinpath(hashlib.sha1(name.encode()).hexdigest() + ".json")
+
+    @staticmethod
+    def _hash(content: str) -> str:
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def get(self, name: str, content: str) -> Optional[Any]:
+        try:
+            entry = json.loads(self._file(name).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("hash") != self._hash(content):
+            return None
+
+        return entry["value"]
+
+    def set(self, name: str, content: str, value: Any) -> None:
+        entry = {"hash": self._hash(content), "value": value}
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            write_file_atomic(self._file(name), json.dumps(entry, ensure_ascii=False).encode())
+        except OSError:
+            pass
+
+
+parse_cache = ParseCache(cfg.tmp_path.joinpath("parse_cache"))
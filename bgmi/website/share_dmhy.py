@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re
 import time
@@ -9,18 +10,29 @@ from bs4 import BeautifulSoup, Tag
 from loguru import logger
 
 from bgmi.config import cfg
-from bgmi.session import session
+from bgmi.http_cache import cached_request
+from bgmi.session import async_get, run_sync, session
 from bgmi.utils import print_error
 from bgmi.website.base import BaseWebsite
 from bgmi.website.model import Episode, SubtitleGroup, WebsiteBangumi
 
 base_url = cfg.share_dmhy_url.encoded_string()
 
+# seconds to use cached programme page without revalidating
+CALENDAR_TTL = 600
 
-def fetch_url(url, **kwargs):
+
+def fetch_url(url, ttl=None, **kwargs):
+    """
+    :param ttl: use response cache with this ttl, ``None`` to disable cache.
+    """
     ret = None
+    headers = {"user-agent": "bgmi-cli"}
     try:
-        ret = session.get(url, timeout=120, **kwargs, headers={"user-agent": "bgmi-cli"}).text
+        if ttl is None:
+            ret = session.get(url, timeout=120, **kwargs, headers=headers).text
+        else:
+            ret = cached_request("GET", url, ttl=ttl, timeout=120, **kwargs, headers=headers).text
     except requests.ConnectionError:
         logger.error("Create connection to {}... failed", base_url)
         print_error("Check internet connection or try to set a DMHY mirror site with share_dmhy_url in config")
@@ -28,6 +40,41 @@ def fetch_url(url, **kwargs):
     return ret
 
 
+async def _fetch_topic_pages(urls):
+    tasks = [asyncio.ensure_future(async_get(url, timeout=120, headers={"user-agent": "bgmi-cli"})) for url in urls]
+    for task in tasks:
+        # retrieve exception of tasks which are not awaited
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    pages = []
+    try:
+        for task in tasks:
+            text = (await task).text
+            if 'id="topic_list"' not in text:
+                break
+            pages.append(text)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return pages
+
+
+def fetch_topic_pages(urls):
+    """
+    fetch pages of topic list concurrently.
+
+    Return content of pages in order until the first page without topic list,
+    requests of the pages after it are cancelled.
+    """
+    try:
+        return run_sync(_fetch_topic_pages(urls))
+    except requests.ConnectionError:
+        logger.error("Create connection to {}... failed", base_url)
+        print_error("Check internet connection or try to set a DMHY mirror site with share_dmhy_url in config")
+    return []
+
+
 def parse_bangumi_with_week_days(content, update_time, array_name) -> List[WebsiteBangumi]:
     content = re.sub("'\\+encodeURIComponent\\('(.*?)'\\)\\+'", "\\1", content)
     content = re.sub("encodeURIComponent\\('(.*?)'\\)", "'URLE#\\1'", content)
@@ -130,13 +177,12 @@ class DmhySource(BaseWebsite):
 
         result = []
         search_url = base_url + "/topics/list/"
-        for i in range(count):
-            params = {"keyword": keyword, "page": i + 1}
+        urls = [search_url + "?" + urllib.parse.urlencode({"keyword": keyword, "page": i + 1}) for i in range(count)]
 
-            if os.environ.get("DEBUG", False):  # pragma: no cover
-                print(search_url, params)
+        if os.environ.get("DEBUG", False):  # pragma: no cover
+            print(urls)
 
-            r = fetch_url(search_url, params=params)
+        for r in fetch_topic_pages(urls):
             bs = BeautifulSoup(r, "html.parser")
 
             table = bs.find("table", {"id": "topic_list"})
@@ -185,7 +231,7 @@ class DmhySource(BaseWebsite):
 
         url = base_url + "/cms/page/name/programme.html"
 
-        r = fetch_url(url)
+        r = fetch_url(url, ttl=CALENDAR_TTL)
 
         for update_time, array_name in week_days_mapping:
             b_list = parse_bangumi_with_week_days(r, update_time, array_name)
@@ -197,7 +243,7 @@ class DmhySource(BaseWebsite):
         print_error("dmhy not support search by tag")
         return []
 
-    def fetch_episode_of_bangumi(self, bangumi_id, max_page=cfg.max_path, subtitle_list=None):
+    def fetch_episode_of_bangumi(self, bangumi_id, max_page=cfg.max_path, subtitle_list=None, since=0):
         """
         get all episode by bangumi id
         example
@@ -218,68 +264,79 @@ class DmhySource(BaseWebsite):
         :type subtitle_list: list
         :param max_page: how many page you want to crawl if there is no subtitle list
         :type max_page: int
+        :param since: following pages are fetched only if all topics of first page are published after it
+        :type since: int
         :return: list of bangumi
         :rtype: list[dict]
         """
-        result = []
         keyword = bangumi_id
         search_url = base_url + "/topics/list/"
-        for i in range(max_page):
-            url = search_url + "?keyword=" + keyword + "&page=" + str(i + 1)
+        # keyword is already url-encoded
+        urls = [search_url + "?keyword=" + keyword + "&page=" + str(i + 1) for i in range(max_page)]
 
-            if os.environ.get("DEBUG", False):  # pragma: no cover
-                print(url)
+        if os.environ.get("DEBUG", False):  # pragma: no cover
+            print(urls)
 
-            r = fetch_url(url)
-            bs = BeautifulSoup(r, "html.parser")
+        result = []
+        if since:
+            # following pages are needed only if all topics of first page are new
+            for r in fetch_topic_pages(urls[:1]):
+                result = self.parse_topic_list(r, keyword)
+            urls = urls[1:] if result and all(e.time > since for e in result) else []
 
-            table = bs.find("table", {"id": "topic_list"})
-            if table is None:
-                break
-            tr_list = table.tbody.find_all("tr")
-            for tr in tr_list:
-                if "class" not in tr.attrs or len(tr.attrs["class"]) != 0:
-                    continue
-                td_list = tr.find_all("td")
+        for r in fetch_topic_pages(urls):
+            result.extend(self.parse_topic_list(r, keyword))
 
-                if td_list[1].a["class"][0] != "sort-2":
-                    continue
+        if subtitle_list:
+            result = [e for e in result if e.subtitle_group in subtitle_list]
 
-                time_string = td_list[0].span.string
-                name = keyword
-                title = td_list[2].find("a", {"target": "_blank"}).get_text(strip=True)
-                download = td_list[3].a["href"]
-                episode = self.parse_episode(title)
-                t = int(time.mktime(time.strptime(time_string, "%Y/%m/%d %H:%M")))
-                subtitle_group = ""
+        return result
 
-                tag_list = td_list[2].find_all("span", {"class": "tag"})
+    def parse_topic_list(self, content, keyword):
+        result = []
+        bs = BeautifulSoup(content, "html.parser")
 
-                for tag in tag_list:
-                    href = tag.a.get("href")
-                    if href is None:
-                        continue
+        table = bs.find("table", {"id": "topic_list"})
+        tr_list = table.tbody.find_all("tr")
+        for tr in tr_list:
+            if "class" not in tr.attrs or len(tr.attrs["class"]) != 0:
+                continue
+            td_list = tr.find_all("td")
 
-                    team_id_raw = re.findall(r"team_id\/(.*)$", href)
-                    if len(team_id_raw) == 0:
-                        continue
-                    subtitle_group = team_id_raw[0]
+            if td_list[1].a["class"][0] != "sort-2":
+                continue
 
-                if subtitle_list:
-                    if subtitle_group not in subtitle_list:
-                        continue
+            time_string = td_list[0].span.string
+            name = keyword
+            title = td_list[2].find("a", {"target": "_blank"}).get_text(strip=True)
+            download = td_list[3].a["href"]
+            episode = self.parse_episode(title)
+            t = int(time.mktime(time.strptime(time_string, "%Y/%m/%d %H:%M")))
+            subtitle_group = ""
 
-                if os.environ.get("DEBUG", False):  # pragma: no cover
-                    print(name, title, subtitle_group, download, episode, t)
+            tag_list = td_list[2].find_all("span", {"class": "tag"})
 
-                result.append(
-                    Episode(
-                        title=title,
-                        subtitle_group=subtitle_group,
-                        download=download,
-                        episode=episode,
-                        time=t,
-                    )
+            for tag in tag_list:
+                href = tag.a.get("href")
+                if href is None:
+                    continue
+
+                team_id_raw = re.findall(r"team_id\/(.*)$", href)
+                if len(team_id_raw) == 0:
+                    continue
+                subtitle_group = team_id_raw[0]
+
+            if os.environ.get("DEBUG", False):  # pragma: no cover
+                print(name, title, subtitle_group, download, episode, t)
+
+            result.append(
+                Episode(
+                    title=title,
+                    subtitle_group=subtitle_group,
+                    download=download,
+                    episode=episode,
+                    time=t,
                 )
+            )
 
         return result
@@ -0,0 +1,94 @@
+"""
+benchmark queries of download list on a synthetic table, before and after migrations::
+
+    python tests/benchmark/download_query.py [rows]
+"""
+
+import random
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+import peewee
+
+from bgmi.lib.models import STATUS_DOWNLOADED, STATUS_NOT_DOWNLOAD, Bangumi, Download, FetchedEpisode, Followed
+from bgmi.lib.update import migrate
+
+MODELS = [Bangumi, Followed, Download, FetchedEpisode]
+
+
+def fill(database: peewee.SqliteDatabase, rows: int) -> None:
+    # schema before migrations: tables without any index
+    database.execute_sql(
+        "CREATE TABLE download (id INTEGER PRIMARY KEY, name TEXT NOT NULL, title TEXT NOT NULL,"
+        " episode INTEGER NOT NULL, download TEXT NOT NULL, status INTEGER NOT NULL, created_time INTEGER)"
+    )
+    database.execute_sql(
+        "CREATE TABLE bangumi (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE,"
+        " subtitle_group TEXT NOT NULL, keyword TEXT NOT NULL, update_time VARCHAR(5) NOT NULL,"
+        " cover TEXT NOT NULL, status INTEGER NOT NULL)"
+    )
+    database.execute_sql(
+        "CREATE TABLE followed (id INTEGER PRIMARY KEY, bangumi_name TEXT NOT NULL UNIQUE,"
+        " episode INTEGER, status INTEGER, updated_time INTEGER)"
+    )
+
+    random.seed(0)
+    data = [
+        {
+            "name": f"bangumi {i % 2000}",
+            "title": f"title {i}",
+            "episode": i // 2000,
+            "download": f"magnet:?xt=urn:btih:{i:040x}",
+            # most of history is downloaded
+            "status": STATUS_NOT_DOWNLOAD if random.random() < 0.01 else STATUS_DOWNLOADED,
+            "created_time": i,
+        }
+        for i in range(rows)
+    ]
+    with database.atomic():
+        for batch in peewee.chunked(data, 500):
+            Download.insert_many(batch).execute()
+        for i in range(2000):
+            Bangumi.insert(
+                name=f"bangumi {i}", subtitle_group="", keyword=str(i), update_time="Mon", cover="", status=i % 2
+            ).execute()
+            if i % 10 == 0:
+                Followed.insert(bangumi_name=f"bangumi {i}", episode=0, status=1, updated_time=i).execute()
+
+
+def bench(database: peewee.SqliteDatabase) -> None:
+    queries = {
+        "download list": Download.select().where(Download.status == STATUS_NOT_DOWNLOAD).order_by(Download.status),
+        "download of episode": Download.select().where((Download.name == "bangumi 42") & (Download.episode == 10)),
+        # same as ``Followed.get_all_followed``
+        "followed": Followed.select(Bangumi.name, Followed)
+        .join(Bangumi, peewee.JOIN.LEFT_OUTER, on=Bangumi.name == Followed.bangumi_name)
+        .where((Followed.status != 0) & (Bangumi.status == 0))
+        .order_by(Followed.updated_time.desc()),
+    }
+    for name, query in queries.items():
+        sql, params = query.sql()
+        plan = database.execute_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        cost = min(timeit.repeat(lambda q=query: list(q.clone()), number=20, repeat=3)) / 20
+        print(f"  {name:<20} {cost * 1000:8.3f} ms  {' / '.join(row[-1] for row in plan)}")
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        database = peewee.SqliteDatabase(Path(tmp, "bangumi.db"))
+        with database.bind_ctx(MODELS):
+            fill(database, rows)
+            print(f"{rows} rows, before migrations")
+            bench(database)
+
+            migrate(database)
+            database.execute_sql("ANALYZE")
+            print("after migrations")
+            bench(database)
+
+
+if __name__ == "__main__":
+    main()
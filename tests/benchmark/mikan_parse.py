@@ -0,0 +1,61 @@
+"""
+micro benchmark of mikan bangumi page parsing.
+
+compare old pipeline (page parsed 3 times with ``html.parser``)
+with current one (page parsed once) on every installed tree builder::
+
+    python tests/benchmark/mikan_parse.py [page.html ...]
+
+default input is ``tests/fixtures/mikan/bangumi.html``,
+save a real page from ``https://mikanani.me/Home/Bangumi/{id}`` to benchmark it.
+"""
+
+import sys
+import timeit
+from pathlib import Path
+from unittest import mock
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+from bgmi.website import mikan
+
+FIXTURE = Path(__file__).parent.parent.joinpath("fixtures/mikan/bangumi.html")
+
+
+def old_pipeline(html: str) -> None:
+    # two soups in ``parse_bangumi_details_page`` and one in ``parse_episodes``
+    with mock.patch.object(mikan, "TREE_BUILDER", "html.parser"):
+        mikan.make_soup(html)
+        mikan.Mikanani().parse_bangumi_details_page(html)
+        mikan._parse_episodes(mikan.make_soup(html), "0")
+
+
+def new_pipeline(html: str, builder: str) -> None:
+    soup = BeautifulSoup(html, builder)
+    mikan.Mikanani().parse_bangumi_details_page(soup)
+    mikan._parse_episodes(soup, "0")
+
+
+def bench(name: str, func, number: int) -> float:
+    cost = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {name:<24} {cost * 1000:8.2f} ms")
+    return cost
+
+
+def main() -> None:
+    files = [Path(x) for x in sys.argv[1:]] or [FIXTURE]
+    builders = [x for x in ("html.parser", "lxml") if builder_registry.lookup(x)]
+
+    for file in files:
+        html = file.read_text(encoding="utf-8")
+        print(f"{file} ({len(html) // 1024} KiB)")
+        number = 20
+        base = bench("3 passes, html.parser", lambda: old_pipeline(html), number)
+        for builder in builders:
+            cost = bench(f"1 pass, {builder}", lambda b=builder: new_pipeline(html, b), number)
+            print(f"  {'':<24} {base / cost:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import os.path
 import shutil
 import tempfile
@@ -10,6 +11,7 @@ import urllib3
 
 from bgmi.config import IS_WINDOWS, cfg
 from bgmi.lib.models import recreate_scripts_table, recreate_source_relatively_table
+from bgmi.plugin.download import BaseDownloadService
 
 
 def pytest_addoption(parser):
@@ -84,5 +86,8 @@ def bangumi_subtitles(data_source_subtitle_name):
 @pytest.fixture()
 def mock_download_driver():
     mock_downloader = mock.Mock()
+    # use default implementation, calls ``add_download`` for each item
+    mock_downloader.add_downloads = functools.partial(BaseDownloadService.add_downloads, mock_downloader)
+    mock_downloader.get_task_statuses = functools.partial(BaseDownloadService.get_task_statuses, mock_downloader)
     with mock.patch("bgmi.lib.download.get_download_driver", mock.Mock(return_value=mock_downloader)):
         yield mock_downloader
@@ -1,6 +1,10 @@
 from unittest import mock
 
+import pytest
+
 from bgmi.downloader.aria2_rpc import Aria2DownloadRPC
+from bgmi.lib.download import reconcile_downloads
+from bgmi.lib.models import STATUS_DOWNLOADED, STATUS_DOWNLOADING, Download
 
 _token = "token:2333"
 
@@ -13,8 +17,43 @@ def test_use_config():
         Aria2DownloadRPC()
         m1.assert_has_calls(
             [
-                mock.call("https://uuu"),
                 mock.call("https://uuu"),
                 mock.call().aria2.getVersion("token:t"),
             ]
         )
+        m1.assert_called_once()
+
+
+def test_add_downloads_multicall():
+    with mock.patch("xmlrpc.client.ServerProxy") as m1:
+        m1.return_value.aria2.getVersion.return_value = {"version": "1.19.1"}
+        m1.return_value.system.multicall.return_value = [["gid1"], {"faultCode": 1, "faultString": "bad uri"}]
+
+        result = Aria2DownloadRPC().add_downloads([("magnet:1", "/a/1"), ("magnet:2", "/a/2")])
+
+    m1.return_value.system.multicall.assert_called_once()
+    assert result[0].task_id == "gid1"
+    assert result[1].task_id is None
+    assert result[1].error.faultString == "bad uri"
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_reconcile_followed_by():
+    Download.create(name="n", title="t", episode=1, download="magnet:1", status=STATUS_DOWNLOADING, task_id="gid1")
+    with mock.patch("xmlrpc.client.ServerProxy") as m1:
+        m1.return_value.aria2.getVersion.return_value = {"version": "1.19.1"}
+        # task of magnet link is complete after metadata is fetched, content is downloaded by gid2
+        m1.return_value.system.multicall.return_value = [[{"status": "complete", "followedBy": ["gid2"]}]]
+        driver = Aria2DownloadRPC()
+
+        with mock.patch("bgmi.lib.download.get_download_driver", return_value=driver):
+            assert reconcile_downloads()["downloading"] == 1
+            assert Download.get().task_id == "gid2"
+
+            m1.return_value.system.multicall.return_value = [[{"status": "complete"}]]
+            assert reconcile_downloads()["downloaded"] == 1
+
+    calls = m1.return_value.system.multicall.call_args_list
+    assert calls[0].args[0][0]["params"][1:] == ["gid1", ["status", "followedBy"]]
+    assert calls[1].args[0][0]["params"][1] == "gid2"
+    assert Download.get().status == STATUS_DOWNLOADED
@@ -0,0 +1,37 @@
+from unittest import mock
+
+import qbittorrentapi
+
+from bgmi.downloader.qbittorrent import QBittorrentWebAPI
+from bgmi.plugin.download import AddDownloadResult
+
+_hash = "0123456789abcdef0123456789abcdef01234567"
+
+
+def test_add_downloads_task_id_from_infohash():
+    with mock.patch("qbittorrentapi.Client") as m1:
+        m1.return_value.torrents_add.return_value = "Ok."
+        m1.return_value.torrents_info.return_value = [mock.Mock(hash=_hash)]
+
+        result = QBittorrentWebAPI().add_downloads(
+            [
+                (f"magnet:?xt=urn:btih:{_hash.upper()}", "/a/1"),
+                ("https://bangumi.moe/t.torrent", "/a/1"),
+                (f"https://mikanani.me/Download/{_hash}.torrent", "/a/2"),
+            ]
+        )
+
+    # only requested torrents are listed, not all torrents of qbittorrent
+    m1.return_value.torrents_info.assert_called_once_with(torrent_hashes=[_hash])
+    assert [x.task_id for x in result] == [_hash, None, _hash]
+    assert all(x.error is None for x in result)
+
+
+def test_add_downloads_check_failed():
+    with mock.patch("qbittorrentapi.Client") as m1:
+        m1.return_value.torrents_add.return_value = "Ok."
+        m1.return_value.torrents_info.side_effect = qbittorrentapi.APIConnectionError("timeout")
+
+        result = QBittorrentWebAPI().add_downloads([(f"magnet:?xt=urn:btih:{_hash}", "/a/1")])
+
+    assert result == [AddDownloadResult(task_id=_hash)]
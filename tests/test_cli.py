@@ -31,6 +31,13 @@ def test_cal_config():
     main_for_test(["config"])
 
 
+def test_debug_db(capsys):
+    main_for_test("debug db".split())
+    out = capsys.readouterr().out
+    assert "journal_mode: `wal`" in out
+    assert "wal_size: `0`" in out
+
+
 def test_add(bangumi_names):
     main_for_test(["add", *bangumi_names])
 
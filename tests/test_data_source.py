@@ -1,9 +1,16 @@
+import time
+from pathlib import Path
+from unittest import mock
+
 import pytest
 
 from bgmi.lib.fetch import DATA_SOURCE_MAP
-from bgmi.website import mikan
+from bgmi.lib.models import STATUS_END, STATUS_UPDATING, Bangumi, Followed, Subtitle
+from bgmi.session import session
+from bgmi.website import bangumi_moe, mikan, share_dmhy
 from bgmi.website.base import BaseWebsite
 from bgmi.website.model import Episode, SubtitleGroup, WebsiteBangumi
+from bgmi.website.parse_cache import ParseCache
 
 
 @pytest.mark.parametrize("source", DATA_SOURCE_MAP.keys())
@@ -55,3 +62,152 @@ def test_mikan_fetch_all_episode():
     w = mikan.Mikanani()
     results = w.fetch_episode_of_bangumi("2242", subtitle_list=["34"])
     assert len(results) > 15, "should fetch more episode in expand button"
+
+
+def test_dmhy_fetch_topic_pages_stop_at_empty_page():
+    requested = []
+
+    def fake_request(method, url, **kwargs):
+        requested.append(url)
+        page = int(url.rsplit("=", 1)[-1])
+        r = mock.Mock()
+        r.text = f'<table id="topic_list">{page}</table>' if page <= 2 else "<p>no result</p>"
+        return r
+
+    urls = [f"https://dmhy.example/topics/list/?keyword=k&page={i}" for i in range(1, 6)]
+    with mock.patch.object(session, "request", fake_request):
+        pages = share_dmhy.fetch_topic_pages(urls)
+
+    assert pages == ['<table id="topic_list">1</table>', '<table id="topic_list">2</table>']
+    assert urls[0] in requested
+
+
+def test_bangumi_moe_fetch_pages_honour_page_count():
+    pages = []
+
+    def fake_request(method, url, **kwargs):
+        page = kwargs["json"]["p"]
+        pages.append(page)
+        r = mock.Mock()
+        r.json.return_value = {"torrents": [{"p": page}], "page_count": 2}
+        return r
+
+    with mock.patch.object(session, "request", fake_request):
+        result = bangumi_moe.fetch_pages(bangumi_moe.SEARCH_URL, lambda page: {"query": "k", "p": page}, 5)
+
+    assert sorted(pages) == [1, 2]
+    assert [x["torrents"][0]["p"] for x in result] == [1, 2]
+
+
+def test_mikan_parse_episodes_reuse_cached_result(tmp_path):
+    html = Path(__file__).parent.joinpath("fixtures/mikan/bangumi.html").read_text(encoding="utf-8")
+
+    with mock.patch.object(mikan, "parse_cache", ParseCache(tmp_path)):
+        episodes = mikan.parse_episodes(html, "3141", ["34"])
+        assert len(episodes) == 12
+
+        with mock.patch.object(mikan, "_parse_episodes") as m:
+            assert mikan.parse_episodes(html, "3141", ["34"]) == episodes
+            m.assert_not_called()
+
+            mikan.parse_episodes(html + " ", "3141", ["34"])
+            m.assert_called_once()
+
+
+def test_mikan_fetch_single_bangumi_parse_page_once(tmp_path):
+    html = Path(__file__).parent.joinpath("fixtures/mikan/bangumi.html").read_text(encoding="utf-8")
+
+    with (
+        mock.patch.object(mikan, "parse_cache", ParseCache(tmp_path)),
+        mock.patch.object(mikan, "get_text", return_value=html),
+        mock.patch.object(mikan, "make_soup", wraps=mikan.make_soup) as m,
+    ):
+        info = mikan.Mikanani().fetch_single_bangumi("3141")
+        assert m.call_count == 1
+
+    assert info.name == "测试番剧"
+    assert info.update_time == "Wed"
+    assert [x.id for x in info.subtitle_group] == ["382", "583", "370", "34", "615"]
+    assert len(info.episodes) == 60
+
+
+def test_mikan_fetch_expand_tables_of_selected_groups():
+    html = Path(__file__).parent.joinpath("fixtures/mikan/bangumi.html").read_text(encoding="utf-8")
+    for subtitle_id in ("382", "34"):
+        html = html.replace(
+            f'<div class="subgroup-text" id="{subtitle_id}">',
+            f'<div class="episode-expand" data-subtitlegroupid="{subtitle_id}"></div>'
+            f'<div class="subgroup-text" id="{subtitle_id}">',
+        )
+
+    # full table has all rows of 34 twice
+    table = mikan.make_soup(html).find("div", id="34").find_next_sibling("div", class_="episode-table").table
+    rows = "".join(str(tr) for tr in table.tbody.find_all("tr"))
+    full_table = f"<table>{table.thead}<tbody>{rows}{rows}</tbody></table>"
+
+    async def fake_get(url, params):
+        return mock.Mock(text=full_table)
+
+    with mock.patch.object(mikan, "async_get", side_effect=fake_get) as m:
+        episodes = mikan._parse_episodes(mikan.make_soup(html), "3141", ["583", "34"])
+
+    m.assert_called_once()
+    assert m.call_args.kwargs["params"]["subtitleGroupId"] == "34"
+    assert [e.subtitle_group for e in episodes] == ["583"] * 12 + ["34"] * 24
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_save_bangumi_list():
+    def calendar(cover):
+        return [
+            WebsiteBangumi(
+                name=f"b{i}",
+                keyword=f"k{i}",
+                update_time="Mon",
+                cover=cover,
+                subtitle_group=[SubtitleGroup(id=str(i), name=f"sub {i}")],
+            )
+            for i in range(3)
+        ]
+
+    assert BaseWebsite.save_bangumi_list(calendar("a")[:2]) == {"inserted": 2, "updated": 0, "unchanged": 0}
+    assert BaseWebsite.save_bangumi_list(calendar("a")) == {"inserted": 1, "updated": 0, "unchanged": 2}
+    assert BaseWebsite.save_bangumi_list(calendar("b")) == {"inserted": 0, "updated": 3, "unchanged": 0}
+
+    assert {b.cover for b in Bangumi.select()} == {"b"}
+
+    # generation of unchanged bangumi is stamped without rewriting them
+    bangumi_list = calendar("b")
+    bangumi_list[0].cover = "c"
+    with mock.patch.object(Bangumi, "bulk_update", wraps=Bangumi.bulk_update) as m:
+        assert BaseWebsite.save_bangumi_list(bangumi_list, generation=5) == {
+            "inserted": 0,
+            "updated": 1,
+            "unchanged": 2,
+        }
+    assert [b.name for b in m.call_args.args[0]] == ["b0"]
+    assert {b.name: (b.cover, b.generation) for b in Bangumi.select()} == {
+        "b0": ("c", 5),
+        "b1": ("b", 5),
+        "b2": ("b", 5),
+    }
+    assert Subtitle.get_subtitle_map(["0", "1", "2"]) == {"0": "sub 0", "1": "sub 1", "2": "sub 2"}
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_fetch_mark_stale_bangumi():
+    calendar = [WebsiteBangumi(name=f"b{i}", keyword=f"k{i}", update_time="Mon") for i in range(3)]
+    w = BaseWebsite()
+
+    with mock.patch.object(w, "fetch_bangumi_calendar", return_value=calendar):
+        w.fetch()
+    Followed(bangumi_name="b1", updated_time=int(time.time())).save()
+
+    with mock.patch.object(w, "fetch_bangumi_calendar", return_value=calendar[2:]):
+        w.fetch(group_by_weekday=False)
+
+    assert {b.name: (b.status, b.generation) for b in Bangumi.select()} == {
+        "b0": (STATUS_END, 1),
+        "b1": (STATUS_UPDATING, 1),  # followed and updated recently
+        "b2": (STATUS_UPDATING, 2),
+    }
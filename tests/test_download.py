@@ -1,12 +1,32 @@
 import os
+import shutil
+import time
 from unittest import mock
 
 import pytest
 
 from bgmi.config import cfg
 from bgmi.lib.controllers import update
-from bgmi.lib.models import Bangumi, Followed
+from bgmi.lib.download import (
+    MAX_ATTEMPTS,
+    UNTRACKED_TIMEOUT,
+    DownloadDriverRegistry,
+    download_prepare,
+    enqueue_downloads,
+    process_download_queue,
+    reconcile_downloads,
+)
+from bgmi.lib.models import (
+    STATUS_DOWNLOAD_ERROR,
+    STATUS_DOWNLOADED,
+    STATUS_DOWNLOADING,
+    STATUS_NOT_DOWNLOAD,
+    Bangumi,
+    Download,
+    Followed,
+)
 from bgmi.main import main_for_test
+from bgmi.plugin.download import DownloadStatus
 from bgmi.website.model import Episode
 
 
@@ -36,12 +56,13 @@ def test_search_download(mock_download_driver: mock.Mock):
 def test_update_download(mock_download_driver: mock.Mock):
     name = "hello world"
     mock_website = mock.Mock()
-    mock_website.get_maximum_episode = mock.Mock(
+    now = int(time.time())
+    mock_website.fetch_bangumi_episodes = mock.Mock(
         return_value=(
-            4,
+            None,
             [
-                Episode(episode=3, download="magnet:mm", title="t 720p", name=name),
-                Episode(episode=4, download="magnet:4", title="t 1080p", name=name),
+                Episode(episode=3, download="magnet:mm", title="t 720p", name=name, time=now),
+                Episode(episode=4, download="magnet:4", title="t 1080p", name=name, time=now),
             ],
         )
     )
@@ -78,3 +99,175 @@ def test_search_with_filter(mock_download_driver: mock.Mock):
     mock_download_driver.add_download.assert_called_once_with(
         url="magnet:mm", save_path=os.path.join(cfg.save_path, "海贼王", "3")
     )
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_download_prepare_reuse_rows(mock_download_driver: mock.Mock):
+    episodes = [
+        Episode(episode=1, download="magnet:1", title="t 1", name="n"),
+        Episode(episode=2, download="magnet:2", title="t 2", name="n"),
+    ]
+    download_prepare(episodes)
+
+    mock_download_driver.add_download.side_effect = [None, ValueError("rpc error")]
+    download_prepare([*episodes, episodes[0]])
+
+    assert mock_download_driver.add_download.call_count == 4
+    assert {(x.download, x.status) for x in Download.select()} == {
+        ("magnet:1", STATUS_DOWNLOADING),
+        ("magnet:2", STATUS_NOT_DOWNLOAD),
+    }
+
+
+def test_download_driver_registry():
+    registry = DownloadDriverRegistry(check_interval=0)
+    with mock.patch.object(DownloadDriverRegistry, "_load", side_effect=lambda _: mock.Mock()) as load:
+        driver = registry.get("aria2-rpc")
+        assert registry.get("aria2-rpc") is driver
+        driver.health_check.assert_called_once()
+
+        driver.health_check.return_value = False
+        assert registry.get("aria2-rpc") is not driver
+        assert load.call_count == 2
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_reconcile_downloads(mock_download_driver: mock.Mock):
+    now = int(time.time())
+    for i, attempts in enumerate([0, 0, 0, MAX_ATTEMPTS - 1]):
+        Download.create(
+            name="n",
+            title=f"t {i}",
+            episode=i,
+            download=f"magnet:{i}",
+            status=STATUS_DOWNLOADING,
+            task_id=str(i),
+            attempts=attempts,
+        )
+    mock_download_driver.get_statuses.return_value = {
+        "0": DownloadStatus.done,
+        "1": DownloadStatus.downloading,
+        "2": DownloadStatus.error,
+        "3": DownloadStatus.error,
+    }
+
+    stats = reconcile_downloads(batch_size=10)
+
+    mock_download_driver.get_statuses.assert_called_once_with(["0", "1", "2", "3"])
+    assert stats == {"downloaded": 1, "retry": 1, "error": 1, "downloading": 1, "missing": 0}
+    rows = {x.episode: x for x in Download.select()}
+    assert rows[0].status == STATUS_DOWNLOADED
+    assert rows[1].status == STATUS_DOWNLOADING
+    assert (rows[2].status, rows[2].task_id, rows[2].attempts) == (STATUS_NOT_DOWNLOAD, None, 1)
+    assert rows[2].next_attempt_time > now
+    assert rows[3].status == STATUS_DOWNLOAD_ERROR
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_reconcile_missing_downloads(mock_download_driver: mock.Mock):
+    name = "test-reconcile-missing"
+    shutil.rmtree(cfg.save_path.joinpath(name), ignore_errors=True)
+    now = int(time.time())
+    old = now - UNTRACKED_TIMEOUT
+    for i, (task_id, created_time) in enumerate([("0", now), ("1", now), (None, old), (None, old), (None, now)]):
+        Download.create(
+            name=name,
+            title=f"t {i}",
+            episode=i,
+            download=f"magnet:{i}",
+            status=STATUS_DOWNLOADING,
+            task_id=task_id,
+            created_time=created_time,
+        )
+    # removed from download delegate after finished
+    for i in (0, 2):
+        cfg.save_path.joinpath(name, str(i)).mkdir(parents=True, exist_ok=True)
+        cfg.save_path.joinpath(name, str(i), f"{i}.mp4").write_bytes(b"1")
+    cfg.save_path.joinpath(name, "1").mkdir(parents=True, exist_ok=True)
+    mock_download_driver.get_statuses.return_value = {"0": DownloadStatus.not_found, "1": DownloadStatus.not_found}
+
+    stats = reconcile_downloads(batch_size=10)
+
+    assert stats == {"downloaded": 2, "retry": 1, "error": 0, "downloading": 0, "missing": 1}
+    rows = {x.episode: x for x in Download.select()}
+    assert rows[0].status == STATUS_DOWNLOADED
+    assert (rows[1].status, rows[1].attempts) == (STATUS_DOWNLOADING, 0)
+    assert rows[2].status == STATUS_DOWNLOADED
+    assert (rows[3].status, rows[3].attempts) == (STATUS_NOT_DOWNLOAD, 1)
+    assert rows[4].status == STATUS_DOWNLOADING
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_process_download_queue(mock_download_driver: mock.Mock):
+    enqueue_downloads([Episode(episode=i, download=f"magnet:{i}", title=f"t {i}", name="n") for i in range(3)])
+    mock_download_driver.add_download.side_effect = [ValueError("rpc error"), "task-1", "task-2", "task-0"]
+
+    with mock.patch("bgmi.config.cfg.max_active_downloads", 2):
+        assert [x.episode for x in process_download_queue()] == [0, 1]
+        # one slot is taken by episode 1, failed episode 0 is not due yet
+        assert [x.episode for x in process_download_queue()] == [2]
+        assert process_download_queue() == []
+
+    failed = Download.get(episode=0)
+    assert (failed.status, failed.attempts) == (STATUS_NOT_DOWNLOAD, 1)
+    assert [x.episode for x in process_download_queue(now=failed.next_attempt_time)] == [0]
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_untracked_download_takes_slot(mock_download_driver: mock.Mock):
+    enqueue_downloads(
+        [Episode(episode=i, download=f"https://t/{i}.torrent", title=f"t {i}", name="n") for i in range(2)]
+    )
+    # download delegate can't tell task id of torrent url
+    mock_download_driver.add_download.return_value = None
+
+    with mock.patch("bgmi.config.cfg.max_active_downloads", 1):
+        assert [x.episode for x in process_download_queue()] == [0]
+        assert process_download_queue() == []
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_dispatch_downloads_error(mock_download_driver: mock.Mock):
+    enqueue_downloads([Episode(episode=i, download=f"magnet:{i}", title=f"t {i}", name="n") for i in range(2)])
+    mock_download_driver.add_downloads = mock.Mock(side_effect=ConnectionError("connection reset"))
+
+    assert len(process_download_queue()) == 2
+    assert {(x.status, x.attempts) for x in Download.select()} == {(STATUS_NOT_DOWNLOAD, 1)}
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_enqueue_downloaded_episode(mock_download_driver: mock.Mock):
+    episodes = [Episode(episode=i, download=f"magnet:{i}", title=f"t {i}", name="n") for i in range(3)]
+    enqueue_downloads(episodes)
+    Download.set_status([Download.get(episode=0).id], STATUS_DOWNLOADED)
+    Download.set_status([Download.get(episode=1).id], STATUS_DOWNLOADING, task_id="task-1")
+    Download.set_status([Download.get(episode=2).id], STATUS_DOWNLOAD_ERROR, next_attempt_time=2**31)
+
+    enqueue_downloads(episodes)
+
+    rows = {x.episode: x for x in Download.select()}
+    assert len(rows) == 3
+    assert rows[0].status == STATUS_DOWNLOADED
+    assert (rows[1].status, rows[1].task_id) == (STATUS_DOWNLOADING, "task-1")
+    assert (rows[2].status, rows[2].next_attempt_time) == (STATUS_NOT_DOWNLOAD, 0)
+    assert [x.episode for x in process_download_queue()] == [2]
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_download_prepare_dedupe_infohash(mock_download_driver: mock.Mock):
+    infohash = "0123456789abcdef0123456789abcdef01234567"
+    download_prepare(
+        [
+            Episode(episode=1, download=f"magnet:?xt=urn:btih:{infohash.upper()}", title="t 1", name="n"),
+            Episode(episode=1, download=f"https://mikanani.me/Download/{infohash}.torrent", title="t 1", name="n"),
+        ]
+    )
+    download_prepare(
+        [Episode(episode=1, download="https://bangumi.moe/t.torrent", title="t", name="n", infohash=infohash)]
+    )
+
+    assert Download.select().count() == 1
+    assert Download.get().infohash == infohash
+    mock_download_driver.add_download.assert_called_once_with(
+        url=f"magnet:?xt=urn:btih:{infohash.upper()}", save_path=os.path.join(cfg.save_path, "n", "1")
+    )
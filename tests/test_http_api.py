@@ -3,14 +3,19 @@ import logging
 import os
 import random
 import string
+import tempfile
+import threading
+from pathlib import Path
 from unittest import mock
 
-from tornado.testing import AsyncHTTPTestCase
+from tornado.testing import AsyncHTTPTestCase, gen_test
 
 from bgmi.config import cfg
-from bgmi.front.base import COVER_URL
+from bgmi.front.base import COVER_URL, app_state
 from bgmi.front.index import get_player
 from bgmi.front.server import make_app
+from bgmi.lib.media import MediaIndex
+from bgmi.lib.models import STATUS_FOLLOWED, Bangumi, Download, Followed
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -160,6 +165,111 @@ class ApiTestCase(AsyncHTTPTestCase):
         r = self.fetch("/resource/calendar.ics")
         assert r.code == 200
 
+    @gen_test
+    async def test_slow_action_not_blocking(self):
+        finished = threading.Event()
+
+        def search(**kwargs):
+            finished.wait(5)
+            return {"status": "success"}
+
+        with (
+            mock.patch("bgmi.front.admin.API_MAP_POST", {"search": search}),
+            mock.patch("bgmi.config.cfg.http.action_timeout", 0.5),
+        ):
+            slow = self.http_client.fetch(
+                self.get_url("/api/search"),
+                method="POST",
+                body=json.dumps({"keyword": self.bangumi_1}),
+                headers=self.headers,
+                raise_error=False,
+            )
+            r = await self.http_client.fetch(self.get_url("/api/index"))
+            assert r.code == 200
+            assert not slow.done()
+
+            r = await slow
+            assert r.code == 504
+            finished.set()
+
+    def test_app_state_cached(self):
+        app_state.invalidate()
+        with mock.patch("bgmi.script.ScriptRunner.get_models_dict", return_value=[]) as m:
+            self.fetch("/api/index")
+            self.fetch("/api/index")
+            m.assert_called_once_with()
+
+            app_state.invalidate()
+            self.fetch("/api/index")
+            assert m.call_count == 2
+
+        # don't leak mocked state to other tests
+        app_state.invalidate()
+
+    def test_index_etag(self):
+        r = self.fetch("/api/index")
+        assert r.code == 200
+        assert b"\n" not in r.body
+        etag = r.headers["Etag"]
+
+        r = self.fetch("/api/index", headers={"If-None-Match": etag})
+        assert r.code == 304
+
+        Followed.create(bangumi_name=random_word(8))
+        r = self.fetch("/api/index", headers={"If-None-Match": etag})
+        assert r.code == 200
+        assert r.headers["Etag"] != etag
+
+        r = self.fetch("/api/index?pretty")
+        assert b"\n" in r.body
+
+    def test_index_etag_new_media_index(self):
+        name = random_word(8)
+        Bangumi.create(name=name, keyword=name, subtitle_group="", update_time="Mon", cover="")
+        Followed.create(bangumi_name=name, status=STATUS_FOLLOWED)
+        episode = cfg.save_path.joinpath(name, "1")
+        episode.mkdir(parents=True)
+        episode.joinpath("1.mp4").write_bytes(b"1")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch("bgmi.front.index.media_index", MediaIndex(Path(tmp, "media_index.json"))):
+                r = self.fetch("/api/index")
+                assert r.code == 200
+                assert {1: {"path": f"/{name}/1/1.mp4"}} == {
+                    int(k): v
+                    for x in json.loads(r.body)["data"]
+                    if x["bangumi_name"] == name
+                    for k, v in x["player"].items()
+                }
+
+                r = self.fetch("/api/index", headers={"If-None-Match": r.headers["Etag"]})
+                assert r.code == 304
+
+    def test_resource_feed_cache(self):
+        name = random_word(8)
+        for i in range(3):
+            Download.create(name=name, title=f"{name} {i}", episode=i, download=f"magnet:{name}{i}", created_time=i + 1)
+
+        r = self.fetch("/resource/feed.xml?limit=2")
+        assert r.code == 200
+        body = r.body.decode()
+        assert f"{name} 2" in body
+        assert body.index(f"{name} 2") < body.index(f"{name} 1")
+        assert f"{name} 0" not in body
+        last_modified = r.headers["Last-Modified"]
+
+        # only status is changed, feed is the same
+        Download.update(status=2).where(Download.name == name).execute()
+        r = self.fetch("/resource/feed.xml?limit=2", headers={"If-Modified-Since": last_modified})
+        assert r.code == 304
+
+        r = self.fetch("/resource/feed.xml?limit=2&since=2")
+        assert f"{name} 2" in r.body.decode()
+        assert f"{name} 1" not in r.body.decode()
+
+        assert self.fetch("/resource/feed.xml?limit=a").code == 400
+        Download.delete().where(Download.name == name).execute()
+
     def test_no_auth(self):
         r = self.fetch("/api/add", method="POST", body=json.dumps({"name": self.bangumi_1}))
         assert r.code == 401
@@ -0,0 +1,47 @@
+from unittest import mock
+
+import requests
+
+from bgmi.http_cache import ResponseCache
+from bgmi.session import session
+
+
+def make_response(status_code, content=b"", headers=None):
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = content
+    r.headers.update(headers or {})
+    r.url = "https://example.com/page"
+    r.encoding = "utf-8"
+    return r
+
+
+def test_revalidate_with_etag(tmp_path):
+    cache = ResponseCache(tmp_path)
+    m = mock.Mock(return_value=make_response(200, b"hello", {"ETag": '"v1"'}))
+
+    with mock.patch.object(session, "request", m):
+        r = cache.request("GET", "https://example.com/page")
+        assert r.text == "hello"
+        assert not r.from_cache
+
+        m.return_value = make_response(304)
+        r = cache.request("GET", "https://example.com/page")
+
+    assert m.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+    assert r.text == "hello"
+    assert r.from_cache
+    assert (cache.stats.misses, cache.stats.revalidated, cache.stats.hits) == (1, 1, 0)
+
+
+def test_ttl_and_request_body_in_key(tmp_path):
+    cache = ResponseCache(tmp_path)
+    m = mock.Mock(side_effect=[make_response(200, b"a"), make_response(200, b"b")])
+
+    with mock.patch.object(session, "request", m):
+        assert cache.request("POST", "https://example.com/api", ttl=60, json={"id": 1}).text == "a"
+        assert cache.request("POST", "https://example.com/api", ttl=60, json={"id": 1}).text == "a"
+        assert cache.request("POST", "https://example.com/api", ttl=60, json={"id": 2}).text == "b"
+
+    assert m.call_count == 2
+    assert cache.stats.hits == 1
@@ -1,4 +1,8 @@
-from bgmi.lib.models import Filter
+import time
+
+import pytest
+
+from bgmi.lib.models import FetchedEpisode, Filter, Subtitle
 from bgmi.website.model import Episode
 
 
@@ -30,3 +34,37 @@ def test_exclude():
     )
     assert len(e) == 2, e
     assert {x.download for x in e} == {"1", "2"}
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_fetched_episode_store():
+    now = int(time.time())
+    episodes = [
+        Episode(name="n", title="n 01 720p", download="magnet:1", episode=1, subtitle_group="a", time=now - 20),
+        Episode(name="n", title="n 02 720p", download="magnet:2", episode=2, subtitle_group="a", time=now - 10),
+        Episode(name="n", title="n 02 1080p", download="magnet:3", episode=2, subtitle_group="b", time=now),
+    ]
+
+    assert FetchedEpisode.save_episodes(episodes[:2]) == 2
+    assert FetchedEpisode.save_episodes(episodes) == 1
+    # same release found by keyword of another bangumi
+    assert FetchedEpisode.save_episodes([episodes[0].model_copy(update={"name": "n 2nd season"})]) == 1
+    assert [e.download for e in FetchedEpisode.get_episodes("n 2nd season")] == ["magnet:1"]
+    assert FetchedEpisode.latest_time("n") == now
+    assert FetchedEpisode.latest_time("other") == 0
+
+    assert [e.download for e in FetchedEpisode.get_episodes("n")] == ["magnet:3", "magnet:2", "magnet:1"]
+    assert FetchedEpisode.get_episodes("n", since=now - 10) == episodes[2:]
+
+    episode, data = FetchedEpisode.get_maximum_episode("n", Filter(subtitle="a", include="720p"))
+    assert episode == 2
+    assert [e.download for e in data] == ["magnet:2", "magnet:1"]
+
+
+@pytest.mark.usefixtures("_clean_bgmi")
+def test_subtitle_map():
+    Subtitle.insert_many([{"id": str(i), "name": f"sub {i}"} for i in range(1200)]).execute()
+
+    subtitle_map = Subtitle.get_subtitle_map([str(i) for i in range(0, 1300, 2)] + [""])
+    assert len(subtitle_map) == 600
+    assert subtitle_map["1000"] == "sub 1000"
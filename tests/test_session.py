@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from bgmi import session
+
+
+def test_async_request_per_host_limit():
+    lock = threading.Lock()
+    running = {"a.example": 0, "b.example": 0}
+    peak = {"a.example": 0, "b.example": 0}
+
+    def fake_request(method, url, **kwargs):
+        host = url.split("/")[2]
+        with lock:
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+        return url
+
+    urls = [f"https://{host}/{i}" for i in range(6) for host in ("a.example", "b.example")]
+
+    with (
+        mock.patch.object(session.session, "request", fake_request),
+        mock.patch("bgmi.config.cfg.max_connections_per_host", 2),
+    ):
+        result = session.gather_sync(*[session.async_get(url) for url in urls])
+
+    assert result == urls
+    assert peak == {"a.example": 2, "b.example": 2}
+
+
+def test_run_sync_inside_running_loop():
+    async def main():
+        return session.run_sync(asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(main()) == "ok"
@@ -0,0 +1,78 @@
+import peewee
+
+from bgmi.lib.models import Bangumi, Download, Followed
+from bgmi.lib.update import MIGRATIONS, migrate
+from bgmi.setup import init_db
+
+
+def test_migrate(tmp_path):
+    database = peewee.SqliteDatabase(tmp_path.joinpath("bangumi.db"))
+    # tables created by an old version, without indexes
+    database.execute_sql(
+        'CREATE TABLE "download" ("id" INTEGER NOT NULL PRIMARY KEY, "name" TEXT NOT NULL, "title" TEXT NOT NULL, '
+        '"episode" INTEGER NOT NULL, "download" TEXT NOT NULL, "status" INTEGER NOT NULL)'
+    )
+    database.execute_sql("ALTER TABLE download ADD COLUMN created_time INT(11)")
+    infohash = "0123456789abcdef0123456789abcdef01234567"
+    rows = [
+        ("n", "t 1", 1, f"magnet:?xt=urn:btih:{infohash.upper()}", 0),
+        ("n", "t 1", 1, f"magnet:?xt=urn:btih:{infohash.upper()}", 2),
+        ("n", "t 1", 1, f"magnet:?xt=urn:btih:{infohash.upper()}", 1),
+        ("n", "t 2", 2, "https://bangumi.moe/t.torrent", 0),
+    ]
+    database.cursor().executemany(
+        "INSERT INTO download (name, title, episode, download, status, created_time) VALUES (?, ?, ?, ?, ?, 0)", rows
+    )
+    with database.bind_ctx([Bangumi, Followed]):
+        database.create_tables([Bangumi, Followed], safe=True)
+        for index in ("bangumi_status_update_time", "followed_status_updated_time"):
+            database.execute_sql(f'DROP INDEX "{index}"')
+
+    assert migrate(database) == len(MIGRATIONS)
+    assert database.pragma("user_version") == len(MIGRATIONS)
+    assert "episode" in database.get_tables()
+    assert "fetchedepisode_bangumi_name_download" in [x.name for x in database.get_indexes("episode")]
+    assert "task_id" in [x.name for x in database.get_columns("download")]
+
+    plan = database.execute_sql("EXPLAIN QUERY PLAN SELECT * FROM download WHERE status = 0").fetchall()
+    assert "USING INDEX download_status_" in str(plan)
+
+    # nothing to do
+    assert migrate(database) == len(MIGRATIONS)
+    assert database.execute_sql("PRAGMA integrity_check").fetchall() == [("ok",)]
+
+    with database.bind_ctx([Download]):
+        # most progressed one of duplicated downloads is kept
+        assert [(x.episode, x.status, x.infohash) for x in Download.select().order_by(Download.episode)] == [
+            (1, 2, infohash),
+            (2, 0, ""),
+        ]
+        assert Download.get(Download.infohash == infohash).title == "t 1"
+
+
+def test_init_db(tmp_path):
+    database = peewee.SqliteDatabase(tmp_path.joinpath("bangumi.db"))
+    init_db(database)
+    assert database.pragma("user_version") == len(MIGRATIONS)
+    assert migrate(database) == len(MIGRATIONS)
+
+
+def test_init_db_existing(tmp_path):
+    database = peewee.SqliteDatabase(tmp_path.joinpath("bangumi.db"))
+    # download table of 4.5.1, with duplicated rows
+    database.execute_sql(
+        "CREATE TABLE download (id INTEGER PRIMARY KEY, name TEXT NOT NULL, title TEXT NOT NULL, "
+        "episode INTEGER NOT NULL, download TEXT NOT NULL, status INTEGER NOT NULL, created_time INTEGER NOT NULL)"
+    )
+    magnet = "magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567"
+    for _ in range(2):
+        database.execute_sql("INSERT INTO download VALUES (NULL, 'n', 't', 1, ?, 0, 0)", (magnet,))
+
+    init_db(database)
+    assert database.pragma("user_version") == 0
+    assert "episode" in database.get_tables()
+
+    assert migrate(database) == len(MIGRATIONS)
+    assert database.execute_sql("PRAGMA integrity_check").fetchall() == [("ok",)]
+    with database.bind_ctx([Download]):
+        assert Download.select().where(Download.infohash == "0123456789abcdef0123456789abcdef01234567").count() == 1
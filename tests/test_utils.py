@@ -1,13 +1,15 @@
 import shutil
 from pathlib import Path
 from typing import List, Tuple
+from unittest import mock
 
 import pytest
 
 from bgmi.config import cfg
 from bgmi.front.index import get_player
+from bgmi.lib.media import MediaIndex, scan_episode
 from bgmi.utils import episode_filter_regex, parse_episode
-from bgmi.website.model import Episode
+from bgmi.website.model import Episode, extract_infohash
 
 _episode_cases: List[Tuple[str, int]] = [
     (
@@ -63,6 +65,25 @@ def test_remove_dupe():
     assert {x.episode for x in e} == {1, 2, 3, 5}
 
 
+@pytest.mark.parametrize(
+    ("link", "infohash"),
+    [
+        (
+            "magnet:?xt=urn:btih:E43B3B6B53DD9FD6AF1199E112D3C7FF15ABCDEF&dn=a",
+            "e43b3b6b53dd9fd6af1199e112d3c7ff15abcdef",
+        ),
+        ("magnet:?xt=urn:btih:AAAQEAYEAUDAOCAJBIFQYDIOB4IBCEQT", "000102030405060708090a0b0c0d0e0f10111213"),
+        (
+            "https://mikanani.me/Download/20230101/e43b3b6b53dd9fd6af1199e112d3c7ff15abcdef.torrent",
+            "e43b3b6b53dd9fd6af1199e112d3c7ff15abcdef",
+        ),
+        ("https://bangumi.moe/download/torrent/5f0c/download.torrent", ""),
+    ],
+)
+def test_extract_infohash(link, infohash):
+    assert extract_infohash(link) == infohash
+
+
 def test_episode_regex():
     e = episode_filter_regex(
         [
@@ -99,3 +120,26 @@ def test_get_player():
         1: {"path": "/test-save-path/ss/1/q/bigger.mkv"},
         2: {"path": "/test-save-path/ss/2/2.mp4"},
     }
+
+
+def test_media_index_update(tmp_path):
+    index = MediaIndex(tmp_path.joinpath("media_index.json"), check_interval=0)
+    name = "test-media-index"
+    bangumi_path = cfg.save_path.joinpath(name)
+    shutil.rmtree(bangumi_path, ignore_errors=True)
+    bangumi_path.joinpath("1").mkdir(parents=True)
+    bangumi_path.joinpath("1", "1.mp4").write_bytes(b"1")
+
+    assert index.get_player(name) == {1: {"path": f"/{name}/1/1.mp4"}}
+
+    # new file in a sub directory is found without rescan
+    bangumi_path.joinpath("1", "sub").mkdir()
+    bangumi_path.joinpath("1", "sub", "bigger.mkv").write_bytes(b"12")
+    with mock.patch("bgmi.lib.media.scan_episode", wraps=scan_episode) as scan:
+        assert index.get_player(name) == {1: {"path": f"/{name}/1/sub/bigger.mkv"}}
+        assert index.get_player(name) == {1: {"path": f"/{name}/1/sub/bigger.mkv"}}
+        scan.assert_called_once()
+
+    # loaded from saved index
+    assert MediaIndex(index.path).get_player(name) == {1: {"path": f"/{name}/1/sub/bigger.mkv"}}
+    assert index.rescan([name]) == {"bangumi": 1, "episodes": 1, "files": 2}